@@ -1,4 +1,6 @@
+import threading
 from abc import ABC, abstractmethod
+from Environment import UNBOUND, Environment
 from Token import TokenType
 
 class NodeType:
@@ -7,8 +9,18 @@ class NodeType:
      InfixExpression = "InfixExpression"
      FloatLiteral = "FloatLiteral"
      IntegerLiteral = "IntegerLiteral"
+     SharedExpression = "SharedExpression"
+     Identifier = "Identifier"
+     AssignStatement = "AssignStatement"
+     FunctionStatement = "FunctionStatement"
+     Parameter = "Parameter"
+     CallExpression = "CallExpression"
+     IfExpression = "IfExpression"
 
 class Node(ABC):
+    # Nodes keep their fields in slots: large programs hold millions of them
+    __slots__ = ()
+
     @abstractmethod
     def type(self):
         pass
@@ -22,14 +34,32 @@ class Node(ABC):
         pass
 
 class Statement(Node, ABC):
-    pass
+    __slots__ = ()
+
+    # Whether evaluating the statement changes the environment
+    side_effects = False
 
 class Expression(Node, ABC):
-    pass
+    __slots__ = ()
+
+    # Levels of InfixExpression from a node down to its deepest leaf
+    depth = 0
+
+# Evaluations after which a Program is compiled to Python code by Tiering.py
+PROMOTION_THRESHOLD = 100
+# Guards Program.evaluations, as cached programs are shared between threads
+_promotion_lock = threading.Lock()
 
 class Program(Node):
-    def __init__(self):
+    __slots__ = ("statements", "environment", "evaluations", "compiled")
+
+    def __init__(self, environment: Environment = None):
         self.statements = []
+        # Variables of the program, shared with every Identifier in it
+        self.environment = environment if environment is not None else Environment()
+        self.evaluations = 0
+        # Function from Tiering.promote() that evaluates the program instead
+        self.compiled = None
 
     def type(self):
         return NodeType.program
@@ -40,12 +70,42 @@ class Program(Node):
             "statements": [stmt.json() for stmt in self.statements]
         }
 
+    def __reduce__(self):
+        # Pickled in the compact binary form of Serialize.py
+        from Serialize import decode, encode
+        return decode, (encode(self), self.environment)
+
     def evaluate(self):
+        if self.compiled is not None:
+            return self.compiled(current_budget() if active_budgets else None)
+        if self.evaluations <= PROMOTION_THRESHOLD:
+            with _promotion_lock:
+                self.evaluations += 1
+                crossed = self.evaluations == PROMOTION_THRESHOLD + 1
+            if crossed:
+                # Only the evaluation that crosses the threshold compiles it, once;
+                # a program that cannot be compiled stays interpreted
+                from Tiering import promote
+                self.compiled = promote(self)
+                if self.compiled is not None:
+                    return self.evaluate()
+
         if not self.statements:
             return None
-        return self.statements[-1].evaluate()
+        # Only the value of the last statement is returned, so the ones
+        # before it are only run for their assignments and definitions
+        statements = self.statements
+        for index in range(len(statements) - 1):
+            if statements[index].side_effects:
+                statements[index].evaluate()
+        return statements[-1].evaluate()
+
+    def bind(self, bindings=None, **values):
+        self.environment.bind(bindings, **values)
 
 class ExpressionStatement(Statement):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: Expression):
         self.expression = expression
 
@@ -61,11 +121,323 @@ class ExpressionStatement(Statement):
     def evaluate(self):
         return self.expression.evaluate()
 
+class AssignStatement(Statement):
+    __slots__ = ("name", "value")
+    side_effects = True
+
+    def __init__(self, name: "Identifier", value: Expression):
+        self.name = name
+        self.value = value
+
+    def type(self):
+        return NodeType.AssignStatement
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "name": self.name.name,
+            "value": self.value.json()
+        }
+
+    def evaluate(self):
+        value = self.value.evaluate()
+        self.name.values[self.name.slot] = value
+        self.name.environment.version += 1
+        return value
+
+class Identifier(Expression):
+    """
+    A variable, resolved to its slot in an Environment when it is parsed.
+    """
+    __slots__ = ("name", "environment", "slot", "values", "line_no", "position")
+
+    def __init__(self, name: str, environment: Environment, line_no: int = 0, position: int = 0):
+        self.name = name
+        self.environment = environment
+        self.slot = environment.resolve(name)
+        self.values = environment.values
+        self.line_no = line_no
+        self.position = position
+
+    def type(self):
+        return NodeType.Identifier
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "name": self.name
+        }
+
+    def evaluate(self):
+        value = self.values[self.slot]
+        if value is UNBOUND:
+            raise ValueError(f"Undefined variable: {self.name}")
+        return value
+
+    def __reduce__(self):
+        # The slot is resolved again, so an identifier can be loaded into
+        # another environment
+        return Identifier, (self.name, self.environment, self.line_no, self.position)
+
+# Results memoized per function before its memo is cleared
+MAX_MEMO_ENTRIES = 1 << 16
+
+class Function:
+    """A function defined with `fn name(parameters) = body`, memoized while the environment is unchanged."""
+    def __init__(self, name: str, parameters: list, environment: Environment):
+        self.name = name
+        self.parameters = parameters
+        self.environment = environment
+        self.body = None
+        self.frame = None
+        self.memo = {}
+        self.memo_version = None
+
+    def __repr__(self):
+        return f"<fn {self.name}({', '.join(self.parameters)})>"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["frame"] = None
+        state["memo"] = {}
+        state["memo_version"] = None
+        return state
+
+class TailCall:
+    __slots__ = ("function", "arguments")
+
+    def __init__(self, function: Function, arguments: list):
+        self.function = function
+        self.arguments = arguments
+
+def _memo_key(arguments: list):
+    # 1 and 1.0, or 0.0 and -0.0, are equal but can give different results
+    for argument in arguments:
+        if argument.__class__ is not int:
+            return tuple(literal_key(argument) for argument in arguments)
+    return tuple(arguments)
+
+def call_function(function: Function, arguments: list):
+    # Only the call that starts a chain of tail calls is memoized; the ones
+    # after it rarely repeat and would crowd it out of the memo
+    memo = None
+    while True:
+        if active_budgets:
+            budget = current_budget()
+            if budget is not None:
+                budget.step()
+        if function.memo_version != function.environment.version:
+            function.memo.clear()
+            function.memo_version = function.environment.version
+        key = _memo_key(arguments)
+        result = function.memo.get(key, TailCall)
+        if result is not TailCall:
+            break
+        if memo is None:
+            memo, memo_key = function.memo, key
+
+        previous = function.frame
+        function.frame = arguments
+        try:
+            result = function.body.evaluate()
+        finally:
+            function.frame = previous
+        if result.__class__ is not TailCall:
+            break
+        function = result.function
+        arguments = result.arguments
+
+    if memo is not None:
+        if len(memo) >= MAX_MEMO_ENTRIES:
+            memo.clear()
+        memo[memo_key] = result
+    return result
+
+class FunctionStatement(Statement):
+    __slots__ = ("name", "function")
+    side_effects = True
+
+    def __init__(self, name: Identifier, function: Function):
+        self.name = name
+        self.function = function
+
+    def type(self):
+        return NodeType.FunctionStatement
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "name": self.name.name,
+            "parameters": self.function.parameters,
+            "body": self.function.body.json()
+        }
+
+    def evaluate(self):
+        self.name.values[self.name.slot] = self.function
+        self.name.environment.version += 1
+        return self.function
+
+class Parameter(Expression):
+    __slots__ = ("name", "function", "index", "line_no", "position")
+
+    def __init__(self, name: str, function: Function, index: int, line_no: int = 0, position: int = 0):
+        self.name = name
+        self.function = function
+        self.index = index
+        self.line_no = line_no
+        self.position = position
+
+    def type(self):
+        return NodeType.Parameter
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "name": self.name
+        }
+
+    def evaluate(self):
+        return self.function.frame[self.index]
+
+class CallExpression(Expression):
+    __slots__ = ("function", "arguments", "tail")
+
+    def __init__(self, function: Expression, arguments: list):
+        self.function = function
+        self.arguments = arguments
+        # Set by the parser when the call is the result of a function body
+        self.tail = False
+
+    def type(self):
+        return NodeType.CallExpression
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "function": self.function.json(),
+            "arguments": [argument.json() for argument in self.arguments]
+        }
+
+    def evaluate(self):
+        function = self.function.evaluate()
+        if function.__class__ is not Function:
+            raise ValueError(f"Not a function: {function!r}")
+        if len(self.arguments) != len(function.parameters):
+            raise ValueError(f"{function.name}() takes {len(function.parameters)} arguments, got {len(self.arguments)}")
+        arguments = [argument.evaluate() for argument in self.arguments]
+        if self.tail:
+            return TailCall(function, arguments)
+        return call_function(function, arguments)
+
+class IfExpression(Expression):
+    """if (condition) consequence else alternative; any non-zero condition is true."""
+    __slots__ = ("condition", "consequence", "alternative")
+
+    def __init__(self, condition: Expression, consequence: Expression, alternative: Expression):
+        self.condition = condition
+        self.consequence = consequence
+        self.alternative = alternative
+
+    def type(self):
+        return NodeType.IfExpression
+
+    def json(self):
+        return {
+            "type": self.type(),
+            "condition": self.condition.json(),
+            "consequence": self.consequence.json(),
+            "alternative": self.alternative.json()
+        }
+
+    def evaluate(self):
+        if self.condition.evaluate():
+            return self.consequence.evaluate()
+        return self.alternative.evaluate()
+
+def mark_tail_calls(body: Expression):
+    pending = [body]
+    while pending:
+        node = pending.pop()
+        if node.__class__ is IfExpression:
+            pending.append(node.consequence)
+            pending.append(node.alternative)
+        elif node.__class__ is CallExpression:
+            node.tail = True
+
+def is_pure(node: Node) -> bool:
+    """
+    Whether `node` neither reads nor assigns a variable, defines or calls a
+    function, so evaluating it always gives the same result.
+    """
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if node.__class__ is InfixExpression:
+            pending.append(node.right)
+            pending.append(node.left)
+        elif isinstance(node, (ExpressionStatement, SharedExpression)):
+            pending.append(node.expression)
+        elif node.__class__ is IfExpression:
+            pending.extend((node.condition, node.consequence, node.alternative))
+        elif isinstance(node, Program):
+            pending.extend(node.statements)
+        elif not isinstance(node, (IntegerLiteral, FloatLiteral)):
+            return False
+    return True
+
+# Trees up to this many levels deep are evaluated recursively, which is the
+# fastest way for ordinary expressions; deeper ones use an explicit stack
+MAX_RECURSIVE_DEPTH = 256
+
+# Number of threads with a Budget, a cheap test before looking one up
+active_budgets = 0
+_budgets_lock = threading.Lock()
+
+class _BudgetSlot(threading.local):
+    budget = None
+
+_budgets = _BudgetSlot()
+
+def current_budget():
+    return _budgets.budget
+
+def set_budget(budget):
+    """Makes `budget` the Budget of the current thread and returns the previous one."""
+    global active_budgets
+    previous = current_budget()
+    _budgets.budget = budget
+    with _budgets_lock:
+        active_budgets += (budget is not None) - (previous is not None)
+    return previous
+
+def _charge_budget(node):
+    # One step per operator and per operand that is not an operator, as
+    # evaluate_deep() charges; a fused a ^ b % m charges both operators
+    budget = current_budget()
+    if budget is not None:
+        steps = 1 + (node.left.__class__ is not InfixExpression) + (node.right.__class__ is not InfixExpression)
+        if node.operator == '%' and node.left.__class__ is InfixExpression and node.left.operator == '^':
+            power = node.left
+            steps += 1 + (power.left.__class__ is not InfixExpression) + (power.right.__class__ is not InfixExpression)
+        budget.step(steps)
+
+def _check_budget(operator, left, right):
+    budget = current_budget()
+    if budget is not None:
+        budget.check(operator, left, right)
+
 class InfixExpression(Expression):
+    __slots__ = ("left", "operator", "right", "depth")
+
     def __init__(self, left: Expression, operator: str, right: Expression):
         self.left = left
         self.operator = operator
         self.right = right
+        # The parser can leave a failed left operand as None
+        depth = left.depth if left is not None else 0
+        if right.depth > depth:
+            depth = right.depth
+        self.depth = depth + 1
 
     def type(self):
         return NodeType.InfixExpression
@@ -79,29 +451,195 @@ class InfixExpression(Expression):
         }
 
     def evaluate(self):
+        if self.depth > MAX_RECURSIVE_DEPTH:
+            return evaluate_deep(self)
+
+        operator = self.operator
+        if active_budgets:
+            # Charged here rather than in a separate evaluator, so a budget
+            # does not change how deep an evaluation can recurse
+            _charge_budget(self)
+        if operator == '%' and self.left.__class__ is InfixExpression and self.left.operator == '^':
+            return evaluate_power_mod(self.left, self.right)
+
         left_val = self.left.evaluate()
         right_val = self.right.evaluate()
 
-        if self.operator == '+':
+        if operator == '+':
             return left_val + right_val
-        elif self.operator == '-':
+        elif operator == '-':
             return left_val - right_val
-        elif self.operator == '*':
+        elif operator == '*':
+            if active_budgets:
+                _check_budget(operator, left_val, right_val)
             return left_val * right_val
-        elif self.operator == '/':
+        elif operator == '/':
             if right_val == 0:
                 raise ValueError("Division by zero")
             return left_val / right_val
-        elif self.operator == '^':
+        elif operator == '^':
+            if active_budgets:
+                _check_budget(operator, left_val, right_val)
             return pow(left_val, right_val)
-        elif self.operator == '%':
+        elif operator == '%':
             return left_val % right_val
+        elif operator == '<':
+            return 1 if left_val < right_val else 0
+        elif operator == '>':
+            return 1 if left_val > right_val else 0
+        elif operator == '==':
+            return 1 if left_val == right_val else 0
         else:
-            raise ValueError(f"Unknown operator: {self.operator}")
+            raise ValueError(f"Unknown operator: {operator}")
+
+def evaluate_power_mod(power, modulus):
+    """
+    Evaluates a ^ b % m, which parses as (a ^ b) % m, with pow(a, b, m) when
+    that gives the same result: for ints with b >= 0 and m != 0. The full
+    power is then never built.
+    """
+    base = power.left.evaluate()
+    exponent = power.right.evaluate()
+    if base.__class__ is int and exponent.__class__ is int and exponent >= 0:
+        modulus = modulus.evaluate()
+        if modulus.__class__ is int and modulus != 0:
+            return pow(base, exponent, modulus)
+        return apply_infix('^', base, exponent) % modulus
+    # The power is computed before the modulus is evaluated, so errors
+    # happen in the same order as without fusing
+    return apply_infix('^', base, exponent) % modulus.evaluate()
+
+def evaluate_deep(node):
+    """Evaluates an expression of any depth by walking left spines in a loop instead of recursing."""
+    limit = MAX_RECURSIVE_DEPTH
+    budget = current_budget()
+    suspended = []
+    while True:
+        spine = []
+        while node.__class__ is InfixExpression and node.depth > limit:
+            spine.append(node)
+            node = node.left
+        if budget is not None and node.__class__ is not InfixExpression:
+            budget.step()
+        value = node.evaluate()
+        index = len(spine) - 1
+
+        while True:
+            while index >= 0:
+                parent = spine[index]
+                right = parent.right
+                if right.__class__ is InfixExpression and right.depth > limit:
+                    break
+                if budget is not None:
+                    budget.step(1 + (right.__class__ is not InfixExpression))
+                right = right.evaluate()
+                value = _apply_spine(spine, index, value, right)
+                index -= 1
+            if index >= 0:
+                suspended.append((spine, index, value))
+                node = right
+                break
+
+            if not suspended:
+                return value
+            spine, index, left = suspended.pop()
+            if budget is not None:
+                budget.step()
+            value = _apply_spine(spine, index, left, value)
+            index -= 1
+
+def _apply_spine(spine, index, left, right):
+    # A ^ whose parent on the spine is a % is deferred, as in evaluate()
+    operator = spine[index].operator
+    if left.__class__ is DeferredPower:
+        return left.modulo(right)
+    if operator == '^' and index and spine[index - 1].operator == '%':
+        return defer_power(left, right)
+    return apply_infix(operator, left, right)
+
+class DeferredPower:
+    """
+    The value of base ^ exponent, not computed yet because a % may follow.
+    Then modulo() uses three-argument pow(), which gives the same result as
+    pow() followed by % without building the full power.
+    """
+    __slots__ = ("base", "exponent")
+
+    def __init__(self, base: int, exponent: int):
+        self.base = base
+        self.exponent = exponent
+
+    def value(self):
+        return apply_infix('^', self.base, self.exponent)
+
+    def modulo(self, modulus):
+        if modulus.__class__ is int and modulus != 0:
+            return pow(self.base, self.exponent, modulus)
+        return self.value() % modulus
+
+def defer_power(base, exponent):
+    """
+    Returns a DeferredPower for an int base and a non-negative int exponent,
+    whose power can never raise. Anything else is computed right away, so
+    errors still happen in evaluation order.
+    """
+    if base.__class__ is int and exponent.__class__ is int and exponent >= 0:
+        return DeferredPower(base, exponent)
+    return apply_infix('^', base, exponent)
+
+# Values of the SharedExpression nodes already evaluated by the innermost
+# SharedStatement running on each thread
+_shared_values = threading.local()
+
+class SharedExpression(Expression):
+    """
+    A subexpression that several parents point to after hash-consing. While
+    a SharedStatement is being evaluated, its value is computed only once.
+    """
+    __slots__ = ("expression", "depth")
+
+    def __init__(self, expression: Expression):
+        self.expression = expression
+        self.depth = expression.depth
+
+    def type(self):
+        return NodeType.SharedExpression
+
+    def json(self):
+        return self.expression.json()
+
+    def evaluate(self):
+        memo = getattr(_shared_values, "memo", None)
+        if memo is None:
+            return self.expression.evaluate()
+        if self in memo:
+            return memo[self]
+        value = memo[self] = self.expression.evaluate()
+        return value
+
+class SharedStatement(ExpressionStatement):
+    """
+    ExpressionStatement whose expression contains SharedExpression nodes.
+    Each evaluation starts from an empty memo, so shared values never leak
+    from one run into the next.
+    """
+    __slots__ = ()
+
+    def evaluate(self):
+        previous = getattr(_shared_values, "memo", None)
+        _shared_values.memo = {}
+        try:
+            return self.expression.evaluate()
+        finally:
+            _shared_values.memo = previous
 
 class FloatLiteral(Expression):
-    def __init__(self, value: float):
+    __slots__ = ("value", "line_no", "position")
+
+    def __init__(self, value: float, line_no: int = 0, position: int = 0):
         self.value = value
+        self.line_no = line_no
+        self.position = position
 
     def type(self):
         return NodeType.FloatLiteral
@@ -116,6 +654,8 @@ class FloatLiteral(Expression):
         return self.value
 
 class IntegerLiteral(Expression):
+    __slots__ = ("value", "line_no", "position")
+
     def __init__(self, value: int, line_no: int = 0, position: int = 0):
         self.value = value
         self.line_no = line_no
@@ -133,91 +673,181 @@ class IntegerLiteral(Expression):
     def evaluate(self):
         return self.value
 
-def evaluate_arithmetic(tokens):
-    if tokens and tokens[-1].type == TokenType.EOF:
-        tokens = tokens[:-1]
+# Distinct values a LiteralTable holds before it starts over, so a long
+# stream of statements cannot grow it without bound
+MAX_INTERNED_LITERALS = 1 << 16
 
-    if not tokens:
-        return 0
+def literal_key(value) -> tuple:
+    # Keyed by type so 1 and 1.0 stay distinct, and by the float's hex form
+    # so -0.0 is not merged into 0.0, nor NaNs into one another
+    return type(value), value.hex() if isinstance(value, float) else value
+
+class LiteralTable:
+    """Flyweight table handing out one literal node per distinct value, first location kept."""
+    __slots__ = ("integers", "floats")
+
+    def __init__(self):
+        self.integers = {}
+        self.floats = {}
+
+    def integer(self, value: int, line_no: int = 0, position: int = 0) -> IntegerLiteral:
+        node = self.integers.get(value)
+        if node is None:
+            if len(self.integers) >= MAX_INTERNED_LITERALS:
+                self.integers.clear()
+            node = self.integers[value] = IntegerLiteral(value, line_no, position)
+        return node
+
+    def float(self, value: float, line_no: int = 0, position: int = 0) -> FloatLiteral:
+        key = literal_key(value)
+        node = self.floats.get(key)
+        if node is None:
+            if len(self.floats) >= MAX_INTERNED_LITERALS:
+                self.floats.clear()
+            node = self.floats[key] = FloatLiteral(value, line_no, position)
+        return node
+
+# Binding strength of each operator in evaluate_arithmetic/evaluate_infix
+INFIX_PRECEDENCE = {'+': 1, '-': 1, '*': 2, '/': 2, '%': 2, '^': 3}
+
+ARITHMETIC_SYMBOLS = {
+    TokenType.PLUS: '+',
+    TokenType.MINUS: '-',
+    TokenType.ASTERISK: '*',
+    TokenType.SLASH: '/',
+    TokenType.POWER: '^',
+    TokenType.MODULO: '%',
+    TokenType.LPAREN: '(',
+    TokenType.RPAREN: ')',
+}
+
+def evaluate_arithmetic(tokens):
+    return evaluate_infix(_arithmetic_items(tokens))
 
-    infix = []
+def _arithmetic_items(tokens):
+    # Tokens that are not part of an arithmetic expression are skipped
     for token in tokens:
         if token.type == TokenType.INT:
-            infix.append(int(token.literal))
+            yield int(token.literal)
         elif token.type == TokenType.FLOAT:
-            infix.append(float(token.literal))
-        elif token.type in [TokenType.PLUS, TokenType.MINUS, TokenType.ASTERISK,
-                            TokenType.SLASH, TokenType.POWER, TokenType.MODULO]:
-            infix.append(token.literal)
-        elif token.type == TokenType.LPAREN:
-            infix.append('(')
-        elif token.type == TokenType.RPAREN:
-            infix.append(')')
-
-    return evaluate_infix(infix)
+            yield float(token.literal)
+        else:
+            symbol = ARITHMETIC_SYMBOLS.get(token.type)
+            if symbol is not None:
+                yield symbol
+
+def apply_infix(operator, left, right):
+    if operator == '+':
+        return left + right
+    elif operator == '-':
+        return left - right
+    elif operator == '*':
+        if active_budgets:
+            _check_budget(operator, left, right)
+        return left * right
+    elif operator == '/':
+        if right == 0:
+            raise ValueError("Division by zero")
+        return left / right
+    elif operator == '^':
+        if active_budgets:
+            _check_budget(operator, left, right)
+        return pow(left, right)
+    elif operator == '%':
+        return left % right
+    elif operator == '<':
+        return 1 if left < right else 0
+    elif operator == '>':
+        return 1 if left > right else 0
+    elif operator == '==':
+        return 1 if left == right else 0
+    else:
+        raise ValueError(f"Unknown operator: {operator}")
 
 def evaluate_infix(infix):
-    if not infix:
+    """
+    Single pass operator-precedence evaluation of numbers, operator symbols
+    and parentheses. Accepts any iterable, so items can be fed straight from
+    the token stream. Every operator is left associative.
+    """
+    values = []
+    operators = []
+    expect_operand = True
+    previous = None
+    budget = current_budget()
+
+    def reduce():
+        if budget is not None:
+            budget.step()
+        # Powers are deferred so a ^ b % m fuses into pow(a, b, m); any
+        # other use computes them
+        right = values.pop()
+        if right.__class__ is DeferredPower:
+            right = right.value()
+        operator = operators.pop()
+        left = values[-1]
+        if left.__class__ is DeferredPower:
+            if operator == '%':
+                values[-1] = left.modulo(right)
+                return
+            left = left.value()
+        if operator == '^':
+            values[-1] = defer_power(left, right)
+        else:
+            values[-1] = apply_infix(operator, left, right)
+
+    for item in infix:
+        if type(item) is not str:
+            if not expect_operand:
+                raise ValueError(f"Invalid expression: unexpected {item!r}")
+            if budget is not None:
+                budget.step()
+            values.append(item)
+            expect_operand = False
+        elif item == '(':
+            if not expect_operand:
+                raise ValueError("Invalid expression: unexpected '('")
+            operators.append(item)
+        elif item == ')':
+            if expect_operand:
+                # An empty group evaluates to 0
+                if previous != '(':
+                    raise ValueError("Invalid expression: unexpected ')'")
+                values.append(0)
+                expect_operand = False
+            while operators and operators[-1] != '(':
+                reduce()
+            if not operators:
+                raise ValueError("Invalid expression: unexpected ')'")
+            operators.pop()
+        else:
+            precedence = INFIX_PRECEDENCE.get(item)
+            if precedence is None:
+                raise ValueError(f"Unknown operator: {item}")
+            if expect_operand:
+                raise ValueError(f"Invalid expression: unexpected {item!r}")
+            while operators and operators[-1] != '(' and INFIX_PRECEDENCE[operators[-1]] >= precedence:
+                reduce()
+            operators.append(item)
+            expect_operand = True
+        previous = item
+
+    if previous is None:
         return 0
-
-    while '(' in infix:
-        open_idx = infix.index('(')
-        close_idx = find_matching_paren(infix, open_idx)
-
-        if close_idx == -1:
+    if expect_operand:
+        if '(' in operators:
             raise ValueError("Mismatched parentheses")
+        raise ValueError("Invalid expression: missing operand")
 
-        sub_result = evaluate_infix(infix[open_idx+1:close_idx])
-        infix = infix[:open_idx] + [sub_result] + infix[close_idx+1:]
+    while operators:
+        if operators[-1] == '(':
+            raise ValueError("Mismatched parentheses")
+        reduce()
 
-    i = 0
-    while i < len(infix):
-        if i+2 < len(infix) and infix[i+1] == '^':
-            infix[i:i+3] = [pow(infix[i], infix[i+2])]
-        else:
-            i += 1
-
-    i = 0
-    while i < len(infix):
-        if i+2 < len(infix) and infix[i+1] in ['*', '/', '%']:
-            op = infix[i+1]
-            if op == '*':
-                infix[i:i+3] = [infix[i] * infix[i+2]]
-            elif op == '/':
-                if infix[i+2] == 0:
-                    raise ValueError("Division by zero")
-                infix[i:i+3] = [infix[i] / infix[i+2]]
-            elif op == '%':
-                infix[i:i+3] = [infix[i] % infix[i+2]]
-        else:
-            i += 1
-
-    i = 0
-    while i < len(infix):
-        if i+2 < len(infix) and infix[i+1] in ['+', '-']:
-            op = infix[i+1]
-            if op == '+':
-                infix[i:i+3] = [infix[i] + infix[i+2]]
-            elif op == '-':
-                infix[i:i+3] = [infix[i] - infix[i+2]]
-        else:
-            i += 1
+    if values[0].__class__ is DeferredPower:
+        return values[0].value()
+    return values[0]
 
-    if len(infix) == 1:
-        return infix[0]
-    else:
-        raise ValueError(f"Invalid expression: {infix}")
-
-def find_matching_paren(expr, open_idx):
-    count = 1
-    for i in range(open_idx + 1, len(expr)):
-        if expr[i] == '(':
-            count += 1
-        elif expr[i] == ')':
-            count -= 1
-            if count == 0:
-                return i
-    return -1
 
 def build_ast(tokens):
     if not tokens:
@@ -236,65 +866,94 @@ def build_ast(tokens):
     return program
 
 def parse_expression(tokens, pos):
-    if pos >= len(tokens):
-        return None, pos
-
-    left = parse_primary(tokens, pos)
-    if not left[0]:
-        return None, left[1]
-
-    return parse_binary_op(tokens, left[0], left[1], 0)
+    return _parse(tokens, _EXPRESSION, pos)
 
 def parse_primary(tokens, pos):
-    if pos >= len(tokens):
-        return None, pos
-
-    token = tokens[pos]
-
-    if token.type == TokenType.INT:
-        return IntegerLiteral(int(token.literal), token.line_no, token.position), pos + 1
-    elif token.type == TokenType.FLOAT:
-        return FloatLiteral(float(token.literal)), pos + 1
-    elif token.type == TokenType.LPAREN:
-        pos += 1
-        expr = parse_expression(tokens, pos)
-        if not expr[0]:
-            return None, expr[1]
-        pos = expr[1]
-        if pos < len(tokens) and tokens[pos].type == TokenType.RPAREN:
-            return expr[0], pos + 1
-        return None, pos
-
-    return None, pos + 1
+    return _parse(tokens, _PRIMARY, pos)
 
 def parse_binary_op(tokens, left, pos, precedence):
-    while pos < len(tokens) and tokens[pos].type != TokenType.EOF and tokens[pos].type != TokenType.RPAREN:
-        token = tokens[pos]
-        current_precedence = get_precedence(token.type)
-
-        if current_precedence < precedence:
-            break
-
-        operator = token.literal
-        pos += 1
-
-        right = parse_primary(tokens, pos)
-        if not right[0]:
-            return left, right[1]
-
-        pos = right[1]
-
-        next_precedence = 0
-        if pos < len(tokens) and tokens[pos].type != TokenType.EOF and tokens[pos].type != TokenType.RPAREN:
-            next_precedence = get_precedence(tokens[pos].type)
-
-        if current_precedence < next_precedence:
-            right = parse_binary_op(tokens, right[0], pos, current_precedence + 1)
-            pos = right[1]
-
-        left = InfixExpression(left, operator, right[0])
-
-    return left, pos
+    return _parse(tokens, _BINARY_OP, pos, left, precedence)
+
+# States of _parse, one per function of the recursive descent
+_EXPRESSION, _PRIMARY, _BINARY_OP = range(3)
+
+# Continuations left on the stack while a nested operand is being parsed
+_AFTER_PRIMARY, _AFTER_GROUP, _AFTER_OPERAND, _AFTER_RIGHT_SIDE = range(4)
+
+def _parse(tokens, state, pos, left=None, precedence=0):
+    """Runs the recursive-descent parse functions with an explicit stack of continuations."""
+    length = len(tokens)
+    stack = []
+    int_type, float_type, lparen, rparen, eof = TokenType.INT, TokenType.FLOAT, TokenType.LPAREN, TokenType.RPAREN, TokenType.EOF
+    while True:
+        result = None
+        if state == _EXPRESSION:
+            if pos < length:
+                stack.append((_AFTER_PRIMARY,))
+                state = _PRIMARY
+                continue
+        elif state == _PRIMARY:
+            if pos < length:
+                token = tokens[pos]
+                token_type = token.type
+                pos += 1
+                if token_type == int_type:
+                    result = IntegerLiteral(int(token.literal), token.line_no, token.position)
+                elif token_type == float_type:
+                    result = FloatLiteral(float(token.literal), token.line_no, token.position)
+                elif token_type == lparen:
+                    stack.append((_AFTER_GROUP,))
+                    state = _EXPRESSION
+                    continue
+        else:
+            result = left
+            if pos < length:
+                token = tokens[pos]
+                token_type = token.type
+                if token_type != eof and token_type != rparen:
+                    current_precedence = get_precedence(token_type)
+                    if current_precedence >= precedence:
+                        stack.append((_AFTER_OPERAND, left, token.literal, current_precedence, precedence))
+                        pos += 1
+                        state = _PRIMARY
+                        continue
+
+        # Hand the result to the innermost waiting continuation
+        while stack:
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == _AFTER_PRIMARY:
+                if result is not None:
+                    left, precedence, state = result, 0, _BINARY_OP
+                    break
+            elif kind == _AFTER_GROUP:
+                if result is not None:
+                    if pos < length and tokens[pos].type == rparen:
+                        pos += 1
+                    else:
+                        result = None
+            elif kind == _AFTER_OPERAND:
+                _, left, operator, current_precedence, precedence = frame
+                if result is None:
+                    result = left
+                    continue
+                next_precedence = 0
+                if pos < length and tokens[pos].type != eof and tokens[pos].type != rparen:
+                    next_precedence = get_precedence(tokens[pos].type)
+                if current_precedence < next_precedence:
+                    stack.append((_AFTER_RIGHT_SIDE, left, operator, precedence))
+                    left, precedence = result, current_precedence + 1
+                else:
+                    left = InfixExpression(left, operator, result)
+                state = _BINARY_OP
+                break
+            else:
+                _, left, operator, precedence = frame
+                left = InfixExpression(left, operator, result)
+                state = _BINARY_OP
+                break
+        else:
+            return result, pos
 
 def get_precedence(token_type):
     if token_type in [TokenType.PLUS, TokenType.MINUS]:
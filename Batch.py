@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterable, List, Mapping, NamedTuple, Optional
+
+from Budget import Budget, add_budget_arguments, budget_from_args
+from Cache import ProgramCache
+
+# Each worker gets several chunks so uneven chunks still balance out, but
+# chunks stay large enough that pickling them is cheap next to evaluating
+CHUNKS_PER_WORKER = 4
+MIN_CHUNK_SIZE = 256
+
+
+class BatchResult(NamedTuple):
+    value: object = None
+    error: Optional[str] = None
+
+
+# Per-process cache, so repeated expressions in a batch are parsed once per worker
+_cache = None
+
+
+def worker_cache() -> ProgramCache:
+    global _cache
+    if _cache is None:
+        _cache = ProgramCache()
+    return _cache
+
+
+def evaluate_expression(source: str, bindings: Mapping[str, object] = None, budget: Budget = None) -> BatchResult:
+    cache = worker_cache()
+    # Expressions are independent, so none sees variables assigned by another
+    cache.environment.reset()
+    try:
+        if bindings:
+            cache.environment.bind(bindings)
+        if budget is None:
+            return BatchResult(cache.evaluate(source))
+        with budget:
+            return BatchResult(cache.evaluate(source))
+    except Exception as e:
+        return BatchResult(error=str(e))
+
+
+def _evaluate_chunk(sources: List[str], budget: Budget = None) -> List[BatchResult]:
+    return [evaluate_expression(source, budget=budget) for source in sources]
+
+
+def evaluate_many(expressions: Iterable[str], workers: int = None, chunk_size: int = None, budget: Budget = None) -> List[BatchResult]:
+    """Evaluates independent expressions in worker processes, returning one BatchResult each, in order."""
+    expressions = list(expressions)
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK_SIZE, -(-len(expressions) // (workers * CHUNKS_PER_WORKER)))
+
+    if workers == 1 or len(expressions) <= chunk_size:
+        return _evaluate_chunk(expressions, budget)
+
+    chunks = [expressions[i:i + chunk_size] for i in range(0, len(expressions), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_results in pool.map(partial(_evaluate_chunk, budget=budget), chunks):
+            results.extend(chunk_results)
+    return results
+
+
+def main(argv: List[str] = None):
+    arg_parser = argparse.ArgumentParser(description="Evaluate one Haxian expression per line in parallel.")
+    arg_parser.add_argument("file", nargs="?", help="file with one expression per line (default: stdin)")
+    arg_parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+    arg_parser.add_argument("--chunk-size", type=int, default=None, help="expressions sent to a worker at a time")
+    add_budget_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
+
+    if args.file:
+        with open(args.file, "r") as file:
+            expressions = file.read().splitlines()
+    else:
+        expressions = sys.stdin.read().splitlines()
+
+    failed = False
+    lines = []
+    for result in evaluate_many(expressions, args.workers, args.chunk_size, budget_from_args(args)):
+        if result.error is not None:
+            failed = True
+            lines.append(f"Error: {result.error}")
+        else:
+            lines.append("" if result.value is None else str(result.value))
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from AST import build_ast, evaluate_arithmetic
+from Compiler import Compiler
+from Lexer import LEXERS
+from Optimizer import count_nodes
+from Parser import Parser
+from Tiering import promote
+from Token import TokenBuffer
+from VM import VM
+
+DEFAULT_OPERATORS = {'+': 4, '-': 3, '*': 3, '/': 1, '%': 1, '^': 1}
+
+# Chance that an operand is a parenthesized group while nesting is allowed,
+# and that a plain operand is a float
+GROUP_PROBABILITY = 0.25
+FLOAT_PROBABILITY = 0.2
+
+# Mismatching expressions kept in the report
+MAX_MISMATCH_EXAMPLES = 10
+
+
+def parse_operator_mix(text: str) -> Dict[str, int]:
+    """Parses an operator mix such as "+=4,*=2,^=1" into weights."""
+    weights = {}
+    for item in text.split(","):
+        operator, _, weight = item.strip().partition("=")
+        if operator not in DEFAULT_OPERATORS:
+            raise ValueError(f"Unknown operator: {operator}")
+        weights[operator] = int(weight or 1)
+    return weights
+
+
+class WorkloadGenerator:
+    """Generates random arithmetic expressions of a given length, depth and operator mix."""
+    def __init__(self, length: int = 8, depth: int = 2, operators: Dict[str, int] = None, seed: int = 0):
+        self.length = length
+        self.depth = depth
+        self.operators = operators or DEFAULT_OPERATORS
+        self.random = random.Random(seed)
+
+    def expression(self, length: int = None, depth: int = None) -> str:
+        length = self.length if length is None else length
+        depth = self.depth if depth is None else depth
+        operators = list(self.operators)
+        weights = list(self.operators.values())
+
+        parts = [self.__operand(depth)]
+        for _ in range(length - 1):
+            operator = self.random.choices(operators, weights)[0]
+            parts.append(operator)
+            if operator == '^':
+                parts.append(str(self.random.randint(0, 3)))
+            else:
+                parts.append(self.__operand(depth))
+        return " ".join(parts)
+
+    def __operand(self, depth: int) -> str:
+        if depth > 0 and self.random.random() < GROUP_PROBABILITY:
+            length = self.random.randint(2, max(2, self.length // 2))
+            return "(" + self.expression(length, depth - 1) + ")"
+        if self.random.random() < FLOAT_PROBABILITY:
+            return f"{self.random.randint(0, 99)}.{self.random.randint(0, 9)}"
+        return str(self.random.randint(1, 99))
+
+    def workload(self, count: int) -> List[str]:
+        return [self.expression() for _ in range(count)]
+
+
+def outcome(evaluate: Callable, item):
+    # Errors are compared by type only, since each engine words them differently
+    try:
+        value = evaluate(item)
+    except Exception as e:
+        return "error", type(e).__name__
+    return type(value).__name__, value
+
+
+def timed(function: Callable, items: list, repeat: int):
+    best = None
+    results = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(item) for item in items]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+def peak_memory(function: Callable, items: list) -> int:
+    tracemalloc.start()
+    try:
+        results = [function(item) for item in items]
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    del results
+    return peak
+
+
+def rate(count: int, seconds: float) -> float:
+    return count / seconds if seconds else 0.0
+
+
+def compile_program(program):
+    return VM(Compiler().compile(program))
+
+
+def promote_program(program) -> Callable:
+    # Programs Tiering cannot compile are measured interpreted
+    compiled = promote(program)
+    if compiled is None:
+        return program.evaluate
+    return lambda: compiled(None)
+
+
+class Benchmark:
+    def __init__(self, expressions: List[str], repeat: int = 3):
+        self.expressions = expressions
+        self.repeat = repeat
+        self.report = {}
+
+    def run(self) -> dict:
+        self.report = {
+            "expressions": len(self.expressions),
+            "characters": sum(map(len, self.expressions)),
+            "lexers": self.__bench_lexers(),
+        }
+
+        buffers = [LEXERS["regex"](source).tokenize(TokenBuffer()) for source in self.expressions]
+        token_lists = [list(buffer) for buffer in buffers]
+        tokens = sum(map(len, buffers))
+
+        parser_seconds, programs = timed(lambda buffer: Parser(buffer).parse_program(), buffers, self.repeat)
+        build_seconds, trees = timed(build_ast, token_lists, self.repeat)
+        nodes = sum(map(count_nodes, programs))
+        tree_nodes = sum(count_nodes(tree) for tree in trees if tree is not None)
+        self.report["parsers"] = {
+            "parser": self.__entry(parser_seconds, nodes=nodes, memory=peak_memory(lambda buffer: Parser(buffer).parse_program(), buffers)),
+            "build_ast": self.__entry(build_seconds, nodes=tree_nodes, memory=peak_memory(build_ast, token_lists)),
+        }
+
+        vms = [compile_program(program) for program in programs]
+        promoted = [promote_program(program) for program in programs]
+        engines = {
+            "evaluate_arithmetic": (evaluate_arithmetic, token_lists),
+            "build_ast": (lambda tree: tree.evaluate(), trees),
+            "parser": (lambda program: program.evaluate(), programs),
+            "tiered": (lambda evaluate: evaluate(), promoted),
+            "vm": (lambda vm: vm.run(), vms),
+        }
+        self.report["engines"] = {}
+        outcomes = {}
+        for name, (evaluate, items) in engines.items():
+            seconds, results = timed(lambda item: outcome(evaluate, item), items, self.repeat)
+            outcomes[name] = results
+            entry = self.__entry(seconds, memory=peak_memory(lambda item: outcome(evaluate, item), items))
+            if name == "evaluate_arithmetic":
+                # Works straight from the tokens, so it also covers parsing
+                entry["tokens_per_second"] = rate(tokens, seconds)
+            self.report["engines"][name] = entry
+
+        self.report["mismatches"] = self.__cross_check(outcomes)
+        return self.report
+
+    def __entry(self, seconds: float, nodes: int = None, memory: int = None) -> dict:
+        entry = {
+            "seconds": seconds,
+            "evals_per_second": rate(len(self.expressions), seconds),
+        }
+        if nodes is not None:
+            entry["nodes"] = nodes
+            entry["nodes_per_second"] = rate(nodes, seconds)
+        if memory is not None:
+            entry["peak_memory_bytes"] = memory
+        return entry
+
+    def __bench_lexers(self) -> dict:
+        report = {}
+        for name, lexer_class in LEXERS.items():
+            seconds, buffers = timed(lambda source: lexer_class(source).tokenize(TokenBuffer()), self.expressions, self.repeat)
+            tokens = sum(map(len, buffers))
+            report[name] = {
+                "seconds": seconds,
+                "tokens": tokens,
+                "tokens_per_second": rate(tokens, seconds),
+                "peak_memory_bytes": peak_memory(lambda source: lexer_class(source).tokenize(TokenBuffer()), self.expressions),
+            }
+
+        # Every lexer has to produce the same tokens as the classic one
+        reference = [list(LEXERS["classic"](source).tokenize(TokenBuffer())) for source in self.expressions]
+        for name, lexer_class in LEXERS.items():
+            report[name]["mismatches"] = sum(
+                [(t.type, t.literal, t.line_no, t.position) for t in lexer_class(source).tokenize()]
+                != [(t.type, t.literal, t.line_no, t.position) for t in tokens]
+                for source, tokens in zip(self.expressions, reference)
+            )
+        return report
+
+    def __cross_check(self, outcomes: Dict[str, list]) -> dict:
+        names = list(outcomes)
+        count = 0
+        examples = []
+        for index, source in enumerate(self.expressions):
+            results = {name: outcomes[name][index] for name in names}
+            if len(set(map(repr, results.values()))) > 1:
+                count += 1
+                if len(examples) < MAX_MISMATCH_EXAMPLES:
+                    examples.append({"expression": source, "results": {name: repr(result) for name, result in results.items()}})
+        return {"count": count, "examples": examples}
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{report['expressions']} expressions, {report['characters']} characters"]
+    for name, entry in report["lexers"].items():
+        lines.append(f"lexer  {name:<20} {entry['tokens_per_second']:>14,.0f} tokens/s  {entry['peak_memory_bytes']:>12,} B peak  {entry['mismatches']} mismatches")
+    for name, entry in report["parsers"].items():
+        lines.append(f"parse  {name:<20} {entry['nodes_per_second']:>14,.0f} nodes/s   {entry['peak_memory_bytes']:>12,} B peak")
+    for name, entry in report["engines"].items():
+        lines.append(f"eval   {name:<20} {entry['evals_per_second']:>14,.0f} evals/s   {entry['peak_memory_bytes']:>12,} B peak")
+    lines.append(f"{report['mismatches']['count']} expressions evaluated differently between engines")
+    for example in report["mismatches"]["examples"]:
+        lines.append(f"  {example['expression']}: {example['results']}")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark and cross-check the Haxian lexers, parsers and evaluators.")
+    arg_parser.add_argument("-n", "--count", type=int, default=2000, help="number of expressions")
+    arg_parser.add_argument("--length", type=int, default=8, help="operands per expression")
+    arg_parser.add_argument("--depth", type=int, default=2, help="maximum parenthesis nesting")
+    arg_parser.add_argument("--operators", default=None, help='operator weights, e.g. "+=4,*=2,^=1"')
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the fastest is reported")
+    arg_parser.add_argument("--json", dest="json_path", default=None, help="write the report to this JSON file")
+    args = arg_parser.parse_args(argv)
+
+    operators = parse_operator_mix(args.operators) if args.operators else None
+    generator = WorkloadGenerator(args.length, args.depth, operators, args.seed)
+    report = Benchmark(generator.workload(args.count), args.repeat).run()
+    report["config"] = vars(args)
+    report["python"] = platform.python_version()
+
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump(report, file, indent=2)
+
+    lexer_mismatches = sum(entry["mismatches"] for entry in report["lexers"].values())
+    return 1 if report["mismatches"]["count"] or lexer_mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
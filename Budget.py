@@ -0,0 +1,97 @@
+import math
+import time
+from typing import Optional
+
+from AST import set_budget
+
+# Steps between two looks at the clock, which is slower than a step
+DEADLINE_CHECK_INTERVAL = 1024
+
+# Bits allowed for an int power or product when only a timeout is given,
+# as the deadline is not checked while one operation runs
+DEFAULT_MAX_BITS = 1 << 22
+
+
+class BudgetExceeded(ValueError):
+    """Raised when an evaluation goes over one of the limits of its Budget."""
+
+
+class StepLimitExceeded(BudgetExceeded):
+    pass
+
+
+class ResultTooLarge(BudgetExceeded):
+    pass
+
+
+class DeadlineExceeded(BudgetExceeded):
+    pass
+
+
+class Budget:
+    """Step, result size and time limits for evaluations run inside `with budget:` on this thread."""
+    def __init__(self, max_steps: int = None, max_bits: int = None, timeout: float = None):
+        self.max_steps = max_steps
+        self.max_bits = DEFAULT_MAX_BITS if max_bits is None and timeout is not None else max_bits
+        self.timeout = timeout
+        self.steps = 0
+        self.deadline = None
+        self.next_check = DEADLINE_CHECK_INTERVAL
+        self.previous = None
+
+    def __enter__(self):
+        self.steps = 0
+        self.next_check = DEADLINE_CHECK_INTERVAL
+        self.deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        self.previous = set_budget(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        set_budget(self.previous)
+        self.previous = None
+        return False
+
+    def __getstate__(self):
+        # Only the limits travel, e.g. to a worker process
+        return {"max_steps": self.max_steps, "max_bits": self.max_bits, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def step(self, count: int = 1):
+        self.steps += count
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise StepLimitExceeded(f"Evaluation exceeded the limit of {self.max_steps} steps")
+        if self.deadline is not None and self.steps >= self.next_check:
+            self.next_check = self.steps + DEADLINE_CHECK_INTERVAL
+            if time.perf_counter() > self.deadline:
+                raise DeadlineExceeded(f"Evaluation exceeded its deadline of {self.timeout} s")
+
+    def check(self, operator: str, left, right):
+        """Raises ResultTooLarge if an int `left operator right` would be too large."""
+        if self.max_bits is None or left.__class__ is not int or right.__class__ is not int:
+            return
+        if operator == '^':
+            if right <= 0 or -1 <= left <= 1:
+                return
+            # The power has at least `right` bits, and `right` itself may be
+            # too large for a float
+            too_large = right > self.max_bits or right * math.log2(abs(left)) > self.max_bits
+        elif operator == '*':
+            too_large = left.bit_length() + right.bit_length() > self.max_bits
+        else:
+            return
+        if too_large:
+            raise ResultTooLarge(f"Result of {operator} would need more than {self.max_bits} bits")
+
+
+def add_budget_arguments(arg_parser, max_steps: int = None, max_bits: int = None, timeout: float = None):
+    arg_parser.add_argument("--max-steps", type=int, default=max_steps, help="fail an evaluation after this many node evaluations")
+    arg_parser.add_argument("--max-bits", type=int, default=max_bits, help="fail an int power or product that would need more bits")
+    arg_parser.add_argument("--timeout", type=float, default=timeout, help="fail an evaluation after this many seconds")
+
+
+def budget_from_args(args) -> Optional[Budget]:
+    if args.max_steps is None and args.max_bits is None and args.timeout is None:
+        return None
+    return Budget(args.max_steps, args.max_bits, args.timeout)
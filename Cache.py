@@ -0,0 +1,179 @@
+import sys
+from collections import OrderedDict
+from typing import Iterator, List
+
+from AST import Program, is_pure
+from Environment import Environment
+from HashCons import Interner
+from Instrumentation import metrics
+from Lexer import create_lexer
+from Optimizer import Optimizer
+from Parser import Parser
+from Token import TokenBuffer
+
+# Rough cost of one parsed token (AST node plus literal) for the byte limit
+BYTES_PER_TOKEN = 160
+
+# Distinct spellings of the same token sequence remembered per entry
+MAX_ALIASES = 8
+
+
+class CacheEntry:
+    __slots__ = ("key", "program", "errors", "pure", "direct", "results", "aliases", "size")
+
+    def __init__(self, key: str, program: Program, errors: List[str], size: int):
+        self.key = key
+        self.program = program
+        self.errors = errors
+        # Results are only remembered for programs without variables
+        self.pure = is_pure(program)
+        # Whether program.evaluate() runs every statement, as results() does,
+        # so evaluate() can use it and get the program compiled once it is hot
+        self.direct = not self.pure and all(statement.side_effects for statement in program.statements[:-1])
+        self.results = None
+        self.aliases = []
+        self.size = size
+
+
+class ProgramCache:
+    """LRU cache from normalized source to its parsed, optimized Program and pure results."""
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, environment: Environment = None):
+        self.environment = environment if environment is not None else Environment()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sources = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.optimizer = Optimizer()
+        self.interner = Interner()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, source: str):
+        return source in self.sources
+
+    @staticmethod
+    def normalize(tokens: TokenBuffer) -> str:
+        # The trailing EOF token is left out
+        return " ".join(map(str, tokens.literals[:-1]))
+
+    def get(self, source: str) -> CacheEntry:
+        """
+        Returns the entry for `source`, lexing and parsing it on a miss.
+        Sources with parse errors are returned but never stored.
+        """
+        key = self.sources.get(source)
+        if key is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        with metrics.phase("lex"):
+            tokens = create_lexer(source).tokenize(TokenBuffer())
+        metrics.count("tokens", len(tokens))
+        key = self.normalize(tokens)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.__add_alias(entry, source)
+            return entry
+
+        self.misses += 1
+        parser = Parser(tokens, self.environment)
+        with metrics.phase("parse"):
+            program = parser.parse_program()
+        metrics.count_nodes(program, "nodes_built")
+        if not parser.errors:
+            with metrics.phase("optimize"):
+                program = self.interner.intern(self.optimizer.optimize(program))
+        entry = CacheEntry(key, program, parser.errors, sys.getsizeof(key) + len(tokens) * BYTES_PER_TOKEN)
+        if not entry.errors:
+            self.entries[key] = entry
+            self.size += entry.size
+            self.__add_alias(entry, source)
+            self.__evict()
+        return entry
+
+    def results(self, entry: CacheEntry) -> Iterator:
+        """
+        Yields the value of each statement, evaluating pure programs only the
+        first time. Results are kept once every statement evaluated
+        successfully.
+        """
+        if entry.results is not None:
+            yield from entry.results
+            return
+
+        results = []
+        for statement in entry.program.statements:
+            with metrics.phase("evaluate"):
+                value = statement.evaluate()
+            metrics.count_nodes(statement, "nodes_visited_static")
+            results.append(value)
+            yield value
+
+        if entry.pure and self.entries.get(entry.key) is entry:
+            entry.results = results
+            growth = sys.getsizeof(results) + sum(map(sys.getsizeof, results))
+            entry.size += growth
+            self.size += growth
+            self.__evict()
+
+    def parse(self, source: str) -> Program:
+        entry = self.get(source)
+        if entry.errors:
+            raise ValueError("; ".join(entry.errors))
+        return entry.program
+
+    def evaluate(self, source: str):
+        entry = self.get(source)
+        if entry.errors:
+            raise ValueError("; ".join(entry.errors))
+        if entry.direct:
+            with metrics.phase("evaluate"):
+                result = entry.program.evaluate()
+            for statement in entry.program.statements:
+                metrics.count_nodes(statement, "nodes_visited_static")
+            return result
+        result = None
+        for result in self.results(entry):
+            pass
+        return result
+
+    def clear(self):
+        self.entries.clear()
+        self.sources.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "eliminated_nodes": self.optimizer.eliminated,
+            "sharing_ratio": self.interner.sharing_ratio,
+        }
+
+    def __add_alias(self, entry: CacheEntry, source: str):
+        if len(entry.aliases) >= MAX_ALIASES:
+            return
+        entry.aliases.append(source)
+        self.sources[source] = entry.key
+        growth = sys.getsizeof(source)
+        entry.size += growth
+        self.size += growth
+
+    def __evict(self):
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            _, entry = self.entries.popitem(last=False)
+            for alias in entry.aliases:
+                del self.sources[alias]
+            self.size -= entry.size
+            self.evictions += 1
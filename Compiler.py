@@ -0,0 +1,137 @@
+from array import array
+from enum import IntEnum
+
+from AST import *
+from Environment import Environment
+
+
+class OpCode(IntEnum):
+    LOAD_CONST = 1
+    ADD = 2
+    SUB = 3
+    MUL = 4
+    DIV = 5
+    POW = 6
+    MOD = 7
+    POP = 8
+    RETURN = 9
+    LOAD_VAR = 10
+    STORE_VAR = 11
+    LT = 12
+    GT = 13
+    EQ = 14
+
+BINARY_OPCODES = {
+    '+': OpCode.ADD,
+    '-': OpCode.SUB,
+    '*': OpCode.MUL,
+    '/': OpCode.DIV,
+    '^': OpCode.POW,
+    '%': OpCode.MOD,
+    '<': OpCode.LT,
+    '>': OpCode.GT,
+    '==': OpCode.EQ,
+}
+
+# Opcodes that carry an operand; every other instruction stores 0 in `args`
+HAS_ARG = {OpCode.LOAD_CONST, OpCode.LOAD_VAR, OpCode.STORE_VAR}
+
+
+class Bytecode:
+    """Flat, compiled form of a Program: an opcode per instruction in `code`, its operand in `args`."""
+    def __init__(self, environment: Environment = None):
+        self.code = array('B')
+        self.args = array('I')
+        self.constants = []
+        self.environment = environment if environment is not None else Environment()
+
+    def __len__(self):
+        return len(self.code)
+
+    def emit(self, opcode: OpCode, arg: int = 0):
+        self.code.append(opcode)
+        self.args.append(arg)
+        return len(self.code) - 1
+
+
+class Compiler:
+    """Compiles programs of arithmetic and assignments, without calls or if, to Bytecode."""
+    def __init__(self):
+        self.bytecode = None
+        self.__constant_index = {}
+
+    def compile(self, program: Program) -> Bytecode:
+        self.bytecode = Bytecode(program.environment)
+        self.__constant_index = {}
+
+        if not program.statements:
+            self.bytecode.emit(OpCode.LOAD_CONST, self.__add_constant(None))
+        # As Program.evaluate() does, statements before the last one are only
+        # run for their side effects, so the others are left out
+        statements = program.statements
+        for i, statement in enumerate(statements):
+            if i < len(statements) - 1 and not statement.side_effects:
+                continue
+            if len(self.bytecode):
+                self.bytecode.emit(OpCode.POP)
+            self.__compile_statement(statement)
+        self.bytecode.emit(OpCode.RETURN)
+
+        return self.bytecode
+
+    def __add_constant(self, value) -> int:
+        key = literal_key(value)
+        index = self.__constant_index.get(key)
+        if index is None:
+            index = len(self.bytecode.constants)
+            self.bytecode.constants.append(value)
+            self.__constant_index[key] = index
+        return index
+
+    def __compile_statement(self, statement: Statement):
+        if isinstance(statement, ExpressionStatement):
+            self.__compile_expression(statement.expression)
+        elif isinstance(statement, AssignStatement):
+            self.__compile_expression(statement.value)
+            self.bytecode.emit(OpCode.STORE_VAR, statement.name.slot)
+        else:
+            raise ValueError(f"Cannot compile statement: {statement.type()}")
+
+    def __compile_expression(self, expression: Expression):
+        # Operands are emitted before their operator, so a stack of pending
+        # nodes and opcodes replaces recursion and any depth compiles
+        pending = [expression]
+        while pending:
+            item = pending.pop()
+            if isinstance(item, OpCode):
+                self.bytecode.emit(item)
+            elif isinstance(item, (IntegerLiteral, FloatLiteral)):
+                self.bytecode.emit(OpCode.LOAD_CONST, self.__add_constant(item.value))
+            elif isinstance(item, Identifier):
+                self.bytecode.emit(OpCode.LOAD_VAR, item.slot)
+            elif isinstance(item, SharedExpression):
+                # The bytecode has no way to reuse a value, so shared
+                # subexpressions are compiled at every use
+                pending.append(item.expression)
+            elif isinstance(item, InfixExpression):
+                opcode = BINARY_OPCODES.get(item.operator)
+                if opcode is None:
+                    raise ValueError(f"Unknown operator: {item.operator}")
+                pending.append(opcode)
+                pending.append(item.right)
+                pending.append(item.left)
+            else:
+                raise ValueError(f"Cannot compile expression: {item.type()} (only arithmetic is compiled to bytecode)")
+
+
+def disassemble(bytecode: Bytecode) -> str:
+    lines = []
+    for offset, (opcode, arg) in enumerate(zip(bytecode.code, bytecode.args)):
+        opcode = OpCode(opcode)
+        if opcode == OpCode.LOAD_CONST:
+            lines.append(f"{offset:>6} {opcode.name:<12} {arg:>4} ({bytecode.constants[arg]!r})")
+        elif opcode in HAS_ARG:
+            lines.append(f"{offset:>6} {opcode.name:<12} {arg:>4} ({bytecode.environment.names[arg]})")
+        else:
+            lines.append(f"{offset:>6} {opcode.name}")
+    return "\n".join(lines)
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import struct
+import tempfile
+from typing import BinaryIO, List, Optional
+
+from AST import Statement
+from Environment import Environment
+from Serialize import decode, encode
+
+CACHE_DIR = "__haxcache__"
+CACHE_SUFFIX = ".haxc"
+
+MAGIC = b"HAXC"
+# Bump FORMAT_VERSION when the file layout changes and INTERPRETER_VERSION
+# when the AST classes or the parser's output change, so stale caches are
+# ignored and rewritten
+FORMAT_VERSION = 2
+INTERPRETER_VERSION = 4
+
+# magic, format version, interpreter version, sha256 of the script
+HEADER = struct.Struct("<4sHH32s")
+# Length of the encoded statement that follows
+RECORD_LENGTH = struct.Struct("<I")
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def cache_path(filename: str) -> str:
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIR, os.path.splitext(name)[0] + CACHE_SUFFIX)
+
+
+def source_hash(file: BinaryIO) -> bytes:
+    """Hashes the rest of a binary file, then rewinds it to where it was."""
+    start = file.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    file.seek(start)
+    return digest.digest()
+
+
+class HashingReader:
+    """Passes reads through to a binary file, hashing the bytes they return."""
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        self.digest = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.file.read(size)
+        self.digest.update(data)
+        return data
+
+
+def make_header(digest: bytes) -> bytes:
+    return HEADER.pack(MAGIC, FORMAT_VERSION, INTERPRETER_VERSION, digest)
+
+
+def load(filename: str, digest: bytes, environment: Environment = None) -> Optional[List[Statement]]:
+    """Returns the cached statements of `filename`, or None for a missing, stale or damaged cache."""
+    if environment is None:
+        environment = Environment()
+    try:
+        with open(cache_path(filename), "rb") as file:
+            data = file.read()
+        view = memoryview(data)
+        if view[:HEADER.size] != make_header(digest):
+            return None
+        statements = []
+        offset = HEADER.size
+        # The statements are followed by a zero length end marker, so a
+        # truncated file is never mistaken for a shorter script
+        while True:
+            length = RECORD_LENGTH.unpack_from(view, offset)[0]
+            offset += RECORD_LENGTH.size
+            if not length:
+                return statements
+            statements.append(decode(view[offset:offset + length], environment))
+            offset += length
+    except Exception:
+        return None
+
+
+class CacheWriter:
+    """Streams statements into a temporary file that close(commit=True) moves over the cache."""
+    def __init__(self, filename: str, digest: bytes):
+        self.path = cache_path(filename)
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix=os.path.basename(self.path), suffix=".tmp", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+        self.failed = False
+        try:
+            self.file.write(make_header(digest))
+        except OSError:
+            self.failed = True
+
+    @classmethod
+    def create(cls, filename: str, digest: bytes) -> Optional["CacheWriter"]:
+        try:
+            return cls(filename, digest)
+        except OSError:
+            return None
+
+    def write(self, statement: Statement):
+        if self.failed:
+            return
+        try:
+            data = encode(statement)
+            self.file.write(RECORD_LENGTH.pack(len(data)))
+            self.file.write(data)
+        except (OSError, ValueError):
+            self.failed = True
+
+    def close(self, commit: bool):
+        try:
+            if commit and not self.failed:
+                self.file.write(RECORD_LENGTH.pack(0))
+                self.file.close()
+                os.replace(self.temp_path, self.path)
+                return
+        except OSError:
+            pass
+        self.file.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
@@ -0,0 +1,99 @@
+from typing import Callable, Dict, Iterable, List, Mapping
+
+
+class _Unbound:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNBOUND"
+
+    def __reduce__(self):
+        return "UNBOUND"
+
+
+# Value of a slot whose variable has not been assigned yet
+UNBOUND = _Unbound()
+
+
+class Environment:
+    """Flat, list-backed variable storage indexed by the slots the parser resolves names to."""
+    def __init__(self):
+        self.slots = {}
+        self.names = []
+        self.values = []
+        # Goes up whenever a value changes, e.g. to drop memoized calls
+        self.version = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __reduce__(self):
+        # The slots are restored first, as the values can hold functions whose
+        # Identifiers look up their slot as soon as they are unpickled
+        return _restore_environment, (list(self.names),), (list(self.values), self.version)
+
+    def __setstate__(self, state):
+        values, self.version = state
+        # In place, as restored Identifiers already refer to this list
+        self.values[:] = values
+
+    def __contains__(self, name: str):
+        slot = self.slots.get(name)
+        return slot is not None and self.values[slot] is not UNBOUND
+
+    def resolve(self, name: str) -> int:
+        """Returns the slot of `name`, giving it a new one if it has none."""
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.values.append(UNBOUND)
+        return slot
+
+    def get(self, name: str, default=None):
+        slot = self.slots.get(name)
+        if slot is None or self.values[slot] is UNBOUND:
+            return default
+        return self.values[slot]
+
+    def bind(self, bindings: Mapping[str, object] = None, **values):
+        """Assigns many variables at once, e.g. bind({"x": 1}, y=2)."""
+        resolve = self.resolve
+        store = self.values
+        for name, value in (bindings or {}).items():
+            store[resolve(name)] = value
+        for name, value in values.items():
+            store[resolve(name)] = value
+        self.version += 1
+
+    def binder(self, names: Iterable[str]) -> Callable:
+        """Returns a function that assigns a sequence of values to `names`, resolved once, in order."""
+        slots = [self.resolve(name) for name in names]
+        store = self.values
+
+        def bind(values):
+            for slot, value in zip(slots, values):
+                store[slot] = value
+            self.version += 1
+        return bind
+
+    def unbind(self, name: str):
+        slot = self.slots.get(name)
+        if slot is not None:
+            self.values[slot] = UNBOUND
+            self.version += 1
+
+    def reset(self):
+        """Unbinds every variable, keeping their slots."""
+        self.values[:] = [UNBOUND] * len(self.values)
+        self.version += 1
+
+    def bindings(self) -> Dict[str, object]:
+        return {name: value for name, value in zip(self.names, self.values) if value is not UNBOUND}
+
+
+def _restore_environment(names: List[str]) -> Environment:
+    environment = Environment()
+    for name in names:
+        environment.resolve(name)
+    return environment
@@ -0,0 +1,124 @@
+from AST import *
+
+
+class Interner:
+    """Hash-consing pass that merges equal literals and subtrees, so shared values are computed once."""
+    def __init__(self):
+        self.tree_nodes = 0
+        self.dag_nodes = 0
+
+    @property
+    def sharing_ratio(self) -> float:
+        """Nodes the programs had as trees per node left after interning."""
+        return self.tree_nodes / self.dag_nodes if self.dag_nodes else 1.0
+
+    def stats(self) -> dict:
+        return {
+            "tree_nodes": self.tree_nodes,
+            "dag_nodes": self.dag_nodes,
+            "sharing_ratio": self.sharing_ratio,
+        }
+
+    def intern(self, program: Program) -> Program:
+        """
+        Returns a Program built from shared nodes, or `program` itself when
+        it has no repeated subtree.
+        """
+        keys = {}
+        entries = []
+        roots = []
+        tree_nodes = 0
+        for statement in program.statements:
+            if isinstance(statement, ExpressionStatement):
+                expression = statement.expression
+            elif isinstance(statement, AssignStatement):
+                expression = statement.value
+            else:
+                roots.append(None)
+                continue
+            root, count = self.__canonicalize(expression, keys, entries)
+            roots.append(root)
+            tree_nodes += count
+
+        self.tree_nodes += tree_nodes
+        self.dag_nodes += len(entries)
+        if len(entries) == tree_nodes:
+            return program
+
+        # Parents of each entry in the DAG
+        parents = [0] * len(entries)
+        for node, key in entries:
+            if node.__class__ is InfixExpression:
+                parents[key[1]] += 1
+                parents[key[2]] += 1
+
+        # Entries only refer to earlier ones, so one pass in order builds them
+        built = []
+        has_shared = []
+        for index, (node, key) in enumerate(entries):
+            shared = False
+            if node.__class__ is InfixExpression:
+                node = InfixExpression(built[key[1]], key[0], built[key[2]])
+                shared = has_shared[key[1]] or has_shared[key[2]]
+                if parents[index] > 1:
+                    node = SharedExpression(node)
+                    shared = True
+            built.append(node)
+            has_shared.append(shared)
+
+        interned = Program(program.environment)
+        for statement, root in zip(program.statements, roots):
+            if root is None:
+                interned.statements.append(statement)
+            elif isinstance(statement, AssignStatement):
+                # Shared values in an assignment are correct but not memoized,
+                # as only a SharedStatement opens a memo
+                interned.statements.append(AssignStatement(statement.name, built[root]))
+            elif has_shared[root]:
+                interned.statements.append(SharedStatement(built[root]))
+            else:
+                interned.statements.append(ExpressionStatement(built[root]))
+        return interned
+
+    @staticmethod
+    def __canonicalize(expression: Expression, keys: dict, entries: list):
+        """
+        Walks `expression` in post-order with an explicit stack, giving every
+        distinct subtree one index into `entries`. Returns the index of the
+        root and the number of nodes in the tree.
+        """
+        count = 0
+        indices = []
+        pending = [(expression, False)]
+        while pending:
+            node, operands_done = pending.pop()
+            if node.__class__ is SharedExpression:
+                pending.append((node.expression, False))
+                continue
+            if node.__class__ is InfixExpression:
+                if not operands_done:
+                    pending.append((node, True))
+                    pending.append((node.right, False))
+                    pending.append((node.left, False))
+                    continue
+                right = indices.pop()
+                left = indices.pop()
+                key = (node.operator, left, right)
+            elif isinstance(node, (IntegerLiteral, FloatLiteral)):
+                key = literal_key(node.value)
+            elif node.__class__ is Identifier:
+                key = ("variable", node.slot)
+            else:
+                key = ("node", id(node))
+
+            count += 1
+            index = keys.get(key)
+            if index is None:
+                index = keys[key] = len(entries)
+                entries.append((node, key))
+            indices.append(index)
+        return indices[0], count
+
+
+def intern(program: Program) -> Program:
+    return Interner().intern(program)
@@ -0,0 +1,215 @@
+import json
+import sys
+import time
+from collections import Counter
+from typing import Callable
+
+from AST import (AssignStatement, CallExpression, ExpressionStatement, FunctionStatement, IfExpression, InfixExpression, Node,
+                 Program, SharedExpression)
+
+# Subscribers are called as callback(event, name, value) where event is
+# "phase" (value is a (wall, cpu) pair of seconds) or "count" (value is the
+# amount added to the counter)
+PHASE_EVENT = "phase"
+COUNT_EVENT = "count"
+
+
+def _tracing():
+    # tracemalloc is only imported once memory is traced, as loading it
+    # would slow down every start of the shell
+    tracemalloc = sys.modules.get("tracemalloc")
+    return tracemalloc if tracemalloc is not None and tracemalloc.is_tracing() else None
+
+
+class _Phase:
+    """
+    Times one run of a phase. Time spent in phases nested inside it is
+    charged to those phases only, so every timer holds exclusive time.
+    """
+    __slots__ = ("metrics", "name", "wall", "cpu", "child_wall", "child_cpu", "memory")
+
+    def __init__(self, metrics: "Instrumentation", name: str):
+        self.metrics = metrics
+        self.name = name
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.memory = None
+
+    def __enter__(self):
+        stack = self.metrics.stack
+        tracemalloc = _tracing() if not stack else None
+        if tracemalloc is not None:
+            tracemalloc.reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        stack = self.metrics.stack
+        stack.pop()
+        if stack:
+            stack[-1].child_wall += wall
+            stack[-1].child_cpu += cpu
+        elif self.memory is not None:
+            peak = sys.modules["tracemalloc"].get_traced_memory()[1] - self.memory
+            self.metrics.peak_memory[self.name] = max(peak, self.metrics.peak_memory.get(self.name, 0))
+        self.metrics.add_time(self.name, wall - self.child_wall, cpu - self.child_cpu)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_PHASE = _NoPhase()
+
+
+class Instrumentation:
+    """Opt-in per-phase wall and CPU time, counters and peak memory; a bare check while disabled."""
+    def __init__(self):
+        self.enabled = False
+        self.subscribers = []
+        self.__started_tracing = False
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = Counter()
+        self.operators = Counter()
+        self.peak_memory = {}
+        self.stack = []
+
+    def enable(self, trace_memory: bool = False):
+        self.enabled = True
+        if trace_memory and _tracing() is None:
+            import tracemalloc
+            tracemalloc.start()
+            self.__started_tracing = True
+
+    def disable(self):
+        self.enabled = False
+        if self.__started_tracing:
+            sys.modules["tracemalloc"].stop()
+            self.__started_tracing = False
+
+    def subscribe(self, callback: Callable):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable):
+        self.subscribers.remove(callback)
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return NO_PHASE
+        return _Phase(self, name)
+
+    def add_time(self, name: str, wall: float, cpu: float):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0.0, 0.0, 0]
+        timer[0] += wall
+        timer[1] += cpu
+        timer[2] += 1
+        for callback in self.subscribers:
+            callback(PHASE_EVENT, name, (wall, cpu))
+
+    def count(self, name: str, amount: int = 1):
+        if not self.enabled:
+            return
+        self.counters[name] += amount
+        for callback in self.subscribers:
+            callback(COUNT_EVENT, name, amount)
+
+    def count_nodes(self, node: Node, counter: str):
+        """Adds the number of nodes in the tree under `node`, not the work evaluating it did, to `counter`."""
+        if not self.enabled:
+            return
+        nodes = 0
+        stack = [node]
+        shared = set()
+        while stack:
+            node = stack.pop()
+            if isinstance(node, SharedExpression):
+                if node not in shared:
+                    shared.add(node)
+                    stack.append(node.expression)
+                continue
+            nodes += 1
+            if isinstance(node, InfixExpression):
+                if counter == "nodes_visited_static":
+                    self.operators[node.operator] += 1
+                stack.append(node.right)
+                stack.append(node.left)
+            elif isinstance(node, ExpressionStatement):
+                stack.append(node.expression)
+            elif isinstance(node, AssignStatement):
+                stack.append(node.value)
+            elif isinstance(node, IfExpression):
+                stack.extend((node.alternative, node.consequence, node.condition))
+            elif isinstance(node, CallExpression):
+                stack.extend(reversed(node.arguments))
+                stack.append(node.function)
+            elif isinstance(node, FunctionStatement):
+                stack.append(node.function.body)
+            elif isinstance(node, Program):
+                stack.extend(node.statements)
+        self.count(counter, nodes)
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "phases": {
+                name: {"wall_seconds": wall, "cpu_seconds": cpu, "calls": calls}
+                for name, (wall, cpu, calls) in self.timers.items()
+            },
+            "counters": dict(self.counters),
+            "operators": dict(self.operators),
+            "peak_memory_bytes": dict(self.peak_memory),
+        }
+
+    def format(self) -> str:
+        if not self.enabled and not self.timers and not self.counters:
+            return "Instrumentation is off (use ':stats on' or start the shell with --stats)"
+        lines = []
+        for name, (wall, cpu, calls) in self.timers.items():
+            memory = self.peak_memory.get(name)
+            line = f"{name:<16} {wall * 1000:>10.3f} ms wall {cpu * 1000:>10.3f} ms cpu {calls:>8} calls"
+            if memory is not None:
+                line += f" {memory:>12,} B peak"
+            lines.append(line)
+        for name, value in self.counters.items():
+            lines.append(f"{name:<16} {value}")
+        if self.operators:
+            lines.append("operators        " + ", ".join(f"{operator} {count}" for operator, count in self.operators.items()))
+        return "\n".join(lines)
+
+    def dump_json(self, path: str):
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+
+class InstrumentedLexer:
+    """Wraps a lexer so every token it produces is timed and counted."""
+    def __init__(self, lexer, metrics: Instrumentation):
+        self.lexer = lexer
+        self.metrics = metrics
+
+    def next_token(self):
+        with self.metrics.phase("lex"):
+            token = self.lexer.next_token()
+        self.metrics.count("tokens")
+        return token
+
+
+# Shared by the shell, the caches and anything else that wants to report
+metrics = Instrumentation()
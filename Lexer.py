@@ -1,12 +1,57 @@
-from typing import List
+import codecs
+import gc
+import re
+from typing import BinaryIO, Iterator, List, TextIO, Union
 
-from Token import Token, TokenType
+from Token import KEYWORDS, Token, TokenBuffer, TokenType, TOKEN_CODES
+
+# Characters (or bytes) read from a file object or mmap at a time
+CHUNK_SIZE = 1 << 16
+
+Source = Union[str, TextIO, BinaryIO]
+
+
+def read_chunks(file, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields the contents of a text or binary file object, or an mmap, as
+    non-empty strings of at most `chunk_size` characters. Bytes are decoded
+    as UTF-8 incrementally, so a character split across reads is kept whole.
+    """
+    decoder = None
+    while True:
+        data = file.read(chunk_size)
+        if not data:
+            break
+        if not isinstance(data, str):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder("utf-8")()
+            data = decoder.decode(data)
+            if not data:
+                continue
+        yield data
+    if decoder is not None:
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+
+def open_source(source: Source):
+    """
+    Returns (text, chunks): the whole text for a str source, otherwise an
+    empty text and an iterator over the chunks of the file.
+    """
+    if isinstance(source, str):
+        return source, None
+    return "", read_chunks(source)
 
 
 # noinspection PyUnreachableCode
 class Lexer:
-    def __init__(self, source: str):
-        self.source = source
+    def __init__(self, source: Source):
+        # For file sources self.source only holds the chunk being read, which
+        # starts at index self.offset of the whole input
+        self.source, self.__chunks = open_source(source)
+        self.offset = 0
         self.position = 1
         self.read_position = 0
         self.line_no = 1
@@ -15,10 +60,18 @@ class Lexer:
         self.__read_char()
 
     def  __read_char(self):
-        if self.read_position >= len(self.source):
+        index = self.read_position - self.offset
+        if index >= len(self.source) and self.__chunks is not None:
+            self.offset += len(self.source)
+            self.source = next(self.__chunks, "")
+            if not self.source:
+                self.__chunks = None
+            index = self.read_position - self.offset
+
+        if index >= len(self.source):
             self.current_char = None
         else:
-            self.current_char = self.source[self.read_position]
+            self.current_char = self.source[index]
 
         self.position = self.read_position
         self.read_position += 1
@@ -67,7 +120,7 @@ class Lexer:
             self.__read_char()
             if self.current_char is None:
                 break
-        return self.__new_token(TokenType.IDENTIFIER, output)
+        return self.__new_token(KEYWORDS.get(output, TokenType.IDENTIFIER), output)
 
     def next_token(self) -> Token:
         self.__skip_whitespace()
@@ -112,6 +165,16 @@ class Lexer:
             case '=':
                 tok = self.__new_token(TokenType.ASSIGN, self.current_char)
                 self.__read_char()
+                if self.current_char == '=':
+                    tok = self.__new_token(TokenType.EQ, "==")
+                    tok.position -= 1
+                    self.__read_char()
+            case '<':
+                tok = self.__new_token(TokenType.LT, self.current_char)
+                self.__read_char()
+            case '>':
+                tok = self.__new_token(TokenType.GT, self.current_char)
+                self.__read_char()
             case ',':
                 tok = self.__new_token(TokenType.COMMA, self.current_char)
                 self.__read_char()
@@ -126,7 +189,15 @@ class Lexer:
 
         return tok
 
-    def tokenize(self) -> List[Token]:
+    def tokenize(self, buffer: TokenBuffer = None) -> Union[List[Token], TokenBuffer]:
+        if buffer is not None:
+            token = self.next_token()
+            while token.type != TokenType.EOF:
+                buffer.append(token.type, token.literal, token.line_no, token.position)
+                token = self.next_token()
+            buffer.append(token.type, token.literal, token.line_no, token.position)
+            return buffer
+
         tokens = []
         token = self.next_token()
 
@@ -136,3 +207,242 @@ class Lexer:
 
         tokens.append(token)
         return tokens
+
+
+SYMBOL_TOKENS = {
+    '+': TokenType.PLUS,
+    '-': TokenType.MINUS,
+    '*': TokenType.ASTERISK,
+    '/': TokenType.SLASH,
+    '^': TokenType.POWER,
+    '%': TokenType.MODULO,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '{': TokenType.LBRACE,
+    '}': TokenType.RBRACE,
+    ';': TokenType.SEMICOLON,
+    '=': TokenType.ASSIGN,
+    ',': TokenType.COMMA,
+    '==': TokenType.EQ,
+    '<': TokenType.LT,
+    '>': TokenType.GT,
+}
+
+SYMBOL_CODES = {char: TOKEN_CODES[tt] for char, tt in SYMBOL_TOKENS.items()}
+KEYWORD_CODES = {word: TOKEN_CODES[tt] for word, tt in KEYWORDS.items()}
+
+# Leading whitespace, then exactly one of: number, identifier, "==", any other character
+TOKEN_PATTERN = re.compile(r"(\s*)(?:([0-9]+(?:\.[0-9]*)?)|([A-Za-z_][A-Za-z0-9_]*)|(==|\S))")
+NUMBER_GROUP = 2
+IDENTIFIER_GROUP = 3
+
+# tokenize() scans ASCII sources in windows of roughly this many characters
+SCAN_WINDOW = 1 << 16
+
+
+class RegexLexer:
+    """Drop-in replacement for Lexer that matches a whole token per step with one master pattern."""
+    def __init__(self, source: Source):
+        self.source, self.__chunks = open_source(source)
+        self.offset = 0
+        self.position = 0
+        self.line_no = 1
+
+    def __fill(self) -> bool:
+        """
+        Drops the consumed text from the window and appends the next chunk.
+        Returns False once the input is exhausted.
+        """
+        if self.__chunks is None:
+            return False
+        chunk = next(self.__chunks, None)
+        if chunk is None:
+            self.__chunks = None
+            return False
+        self.source = self.source[self.position - self.offset:] + chunk
+        self.offset = self.position
+        return True
+
+    @staticmethod
+    def __is_identifier_char(char):
+        return char.isalpha() or char == '_' or char.isdigit()
+
+    def __read_identifier(self, end: int) -> int:
+        # The pattern only covers ASCII identifiers; non-ASCII letters and
+        # digits follow the same rules as Lexer
+        source = self.source
+        while end < len(source) and self.__is_identifier_char(source[end]):
+            end += 1
+        return end
+
+    def __multiple_dots(self, text: str, end: int) -> bool:
+        if '.' in text and self.source[end:end + 1] == '.':
+            print(f"Error: Multiple dots in number at line {self.line_no}, position {self.offset + end}")
+            return True
+        return False
+
+    def next_token(self) -> Token:
+        while True:
+            source = self.source
+            index = self.position - self.offset
+            m = TOKEN_PATTERN.match(source, index)
+            if m is None:
+                if self.__fill():
+                    continue
+                self.line_no += source.count('\n', index)
+                self.position = self.offset + len(source)
+                return Token(TokenType.EOF, "", self.line_no, self.position)
+
+            group = m.lastindex
+            start = m.start(group)
+            end = m.end()
+            text = m.group(group)
+            identifier = group == IDENTIFIER_GROUP or (text >= '\x80' and text.isalpha())
+            if identifier and (group != IDENTIFIER_GROUP or source[end:end + 1] >= '\x80'):
+                end = self.__read_identifier(end)
+            # A token reaching the end of the window may continue in the next chunk
+            if end < len(source) or not self.__fill():
+                break
+
+        self.line_no += source.count('\n', index, start)
+        offset = self.offset
+
+        if group == NUMBER_GROUP:
+            if self.__multiple_dots(text, end):
+                tok = Token(TokenType.ILLEGAL, text, self.line_no, offset + end)
+            elif '.' in text:
+                tok = Token(TokenType.FLOAT, float(text), self.line_no, offset + end)
+            else:
+                tok = Token(TokenType.INT, int(text), self.line_no, offset + end)
+        elif identifier:
+            text = source[start:end]
+            tok = Token(KEYWORDS.get(text, TokenType.IDENTIFIER), text, self.line_no, offset + end)
+        else:
+            tok = Token(SYMBOL_TOKENS.get(text, TokenType.ILLEGAL), text, self.line_no, offset + start)
+
+        self.position = offset + end
+        return tok
+
+    def tokenize(self, buffer: TokenBuffer = None) -> Union[List[Token], TokenBuffer]:
+        """
+        Tokenizes the rest of the source. With a TokenBuffer the tokens are
+        written straight into its columns and the buffer is returned.
+        """
+        into = TokenBuffer() if buffer is None else buffer
+
+        while True:
+            source = self.source
+            stop = len(source) if self.__chunks is None else self.__scan_end()
+
+            if source.isascii():
+                self.__tokenize_ascii(into, stop)
+            elif self.__tokenize_tokens(into, self.offset + stop):
+                break
+
+            if not self.__fill() and self.position >= self.offset + len(self.source):
+                break
+
+        into.append(TokenType.EOF, "", self.line_no, self.position)
+
+        if buffer is not None:
+            return buffer
+
+        # Building millions of tokens would otherwise trigger a cyclic GC
+        # pass every few hundred allocations
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return list(into)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def __scan_end(self) -> int:
+        """End of the complete tokens in the window: its last newline, else the start of an unfinished token."""
+        source = self.source
+        start = self.position - self.offset
+        stop = source.rfind('\n', start)
+        if stop != -1:
+            return stop
+        stop = len(source)
+        while stop > start and (source[stop - 1].isalnum() or source[stop - 1] in "_.="):
+            stop -= 1
+        return stop
+
+    def __tokenize_tokens(self, buffer: TokenBuffer, stop: int) -> bool:
+        # Returns True once EOF is reached, leaving the EOF token to the caller
+        while self.position < stop:
+            token = self.next_token()
+            if token.type == TokenType.EOF:
+                return True
+            buffer.append(token.type, token.literal, token.line_no, token.position)
+        return False
+
+    def __tokenize_ascii(self, buffer: TokenBuffer, length: int):
+        source = self.source
+        offset = self.offset
+        findall = TOKEN_PATTERN.findall
+        kinds = buffer.kinds.append
+        literals = buffer.literals.append
+        line_nos = buffer.line_nos.append
+        positions = buffer.positions.append
+        int_code = TOKEN_CODES[TokenType.INT]
+        float_code = TOKEN_CODES[TokenType.FLOAT]
+        identifier_code = TOKEN_CODES[TokenType.IDENTIFIER]
+        illegal_code = TOKEN_CODES[TokenType.ILLEGAL]
+        symbol_codes = SYMBOL_CODES
+        keyword_codes = KEYWORD_CODES
+        position = self.position - offset
+        line_no = self.line_no
+
+        while position < length:
+            # Tokens never contain a newline, so windows that end on one can
+            # be scanned independently
+            stop = source.find('\n', position + SCAN_WINDOW, length)
+            if stop == -1:
+                stop = length
+            for space, number, identifier, char in findall(source, position, stop):
+                if space:
+                    position += len(space)
+                    if '\n' in space:
+                        line_no += space.count('\n')
+                if number:
+                    position += len(number)
+                    if '.' not in number:
+                        kinds(int_code)
+                        literals(int(number))
+                    else:
+                        self.line_no = line_no
+                        if self.__multiple_dots(number, position):
+                            kinds(illegal_code)
+                            literals(number)
+                        else:
+                            kinds(float_code)
+                            literals(float(number))
+                elif identifier:
+                    position += len(identifier)
+                    kinds(keyword_codes.get(identifier, identifier_code))
+                    literals(identifier)
+                else:
+                    kinds(symbol_codes.get(char, illegal_code))
+                    literals(char)
+                    position += len(char)
+                line_nos(line_no)
+                positions(offset + (position if char == '' else position - len(char)))
+            line_no += source.count('\n', position, stop)
+            position = stop
+
+        self.position = offset + length
+        self.line_no = line_no
+
+
+LEXERS = {
+    "classic": Lexer,
+    "regex": RegexLexer,
+}
+
+def create_lexer(source: Source, engine: str = "regex"):
+    lexer_class = LEXERS.get(engine)
+    if lexer_class is None:
+        raise ValueError(f"Unknown lexer engine: {engine}")
+    return lexer_class(source)
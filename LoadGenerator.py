@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import json
+import math
+import sys
+import time
+from typing import List
+
+from Benchmark import WorkloadGenerator, rate
+from Server import DEFAULT_PORT, MAX_LINE_BYTES
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class LoadGenerator:
+    """
+    Sends `expressions` to an EvaluationServer over `connections` concurrent
+    connections, each keeping up to `window` requests in flight, and times
+    every request from when it is written until its response is read.
+    """
+    def __init__(self, expressions: List[str], connections: int = 4, window: int = 16, bindings: dict = None):
+        self.expressions = expressions
+        self.connections = max(1, connections)
+        self.window = max(1, window)
+        self.bindings = bindings
+
+    async def run(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: str = None) -> dict:
+        latencies = []
+        errors = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.__connection(self.expressions[index::self.connections], host, port, path, latencies, errors)
+            for index in range(self.connections)
+        ))
+        seconds = time.perf_counter() - start
+
+        latencies.sort()
+        report = {
+            "requests": len(latencies),
+            "errors": len(errors),
+            "seconds": seconds,
+            "requests_per_second": rate(len(latencies), seconds),
+            "latency_ms": {f"p{fraction * 100:g}": percentile(latencies, fraction) * 1000 for fraction in PERCENTILES},
+        }
+        report["latency_ms"]["max"] = latencies[-1] * 1000 if latencies else 0.0
+        return report
+
+    async def __connection(self, expressions: List[str], host: str, port: int, path: str, latencies: list, errors: list):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=MAX_LINE_BYTES)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_BYTES)
+        window = asyncio.Semaphore(self.window)
+        sent = {}
+
+        async def send():
+            for request_id, expression in enumerate(expressions):
+                await window.acquire()
+                request = {"id": request_id, "expression": expression}
+                if self.bindings:
+                    request["bindings"] = self.bindings
+                sent[request_id] = time.perf_counter()
+                writer.write((json.dumps(request) + "\n").encode())
+                await writer.drain()
+
+        async def receive():
+            for _ in expressions:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Server closed the connection")
+                response = json.loads(line)
+                latencies.append(time.perf_counter() - sent.pop(response["id"]))
+                if "error" in response:
+                    errors.append(response["error"])
+                window.release()
+
+        try:
+            await asyncio.gather(send(), receive())
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+
+def format_report(report: dict) -> str:
+    latency = "  ".join(f"{name} {value:.3f} ms" for name, value in report["latency_ms"].items())
+    return "\n".join([
+        f"{report['requests']} requests, {report['errors']} errors in {report['seconds']:.3f} s",
+        f"throughput {report['requests_per_second']:,.0f} requests/s",
+        f"latency    {latency}",
+    ])
+
+
+def main(argv: List[str] = None):
+    arg_parser = argparse.ArgumentParser(description="Measure throughput and latency of a running Haxian server.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument("--unix", metavar="PATH", default=None, help="connect to this Unix socket instead of TCP")
+    arg_parser.add_argument("-c", "--connections", type=int, default=4, help="concurrent connections")
+    arg_parser.add_argument("-w", "--window", type=int, default=16, help="requests in flight per connection")
+    arg_parser.add_argument("--file", default=None, help="file with one expression per line (default: a generated workload)")
+    arg_parser.add_argument("-n", "--count", type=int, default=10000, help="number of generated expressions")
+    arg_parser.add_argument("--length", type=int, default=8, help="operands per generated expression")
+    arg_parser.add_argument("--depth", type=int, default=2, help="maximum parenthesis nesting")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--bindings", default=None, help='JSON object of variables sent with every request, e.g. {"x": 2}')
+    arg_parser.add_argument("--json", dest="json_path", default=None, help="write the report to this JSON file")
+    args = arg_parser.parse_args(argv)
+
+    if args.file:
+        with open(args.file, "r") as file:
+            expressions = [line for line in file.read().splitlines() if line.strip()]
+    else:
+        expressions = WorkloadGenerator(args.length, args.depth, seed=args.seed).workload(args.count)
+    bindings = json.loads(args.bindings) if args.bindings else None
+
+    generator = LoadGenerator(expressions, args.connections, args.window, bindings)
+    report = asyncio.run(generator.run(args.host, args.port, args.unix))
+    report["config"] = vars(args)
+
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+from AST import *
+
+# Integer powers are only folded while the result stays below this many bits,
+# so a constant like 9 ^ 999999 is left for the evaluator
+MAX_FOLDED_BITS = 1 << 16
+
+
+def count_nodes(node: Node) -> int:
+    count = 0
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        count += 1
+        if isinstance(node, Program):
+            pending.extend(node.statements)
+        elif isinstance(node, (ExpressionStatement, SharedExpression)):
+            pending.append(node.expression)
+        elif isinstance(node, AssignStatement):
+            pending.append(node.value)
+        elif isinstance(node, InfixExpression):
+            pending.append(node.right)
+            pending.append(node.left)
+        elif isinstance(node, IfExpression):
+            pending.extend((node.alternative, node.consequence, node.condition))
+        elif isinstance(node, CallExpression):
+            pending.extend(reversed(node.arguments))
+            pending.append(node.function)
+        elif isinstance(node, FunctionStatement):
+            pending.append(node.function.body)
+    return count
+
+
+def is_literal(node: Node) -> bool:
+    return isinstance(node, (IntegerLiteral, FloatLiteral))
+
+
+def is_integer(node: Node, value: int) -> bool:
+    return isinstance(node, IntegerLiteral) and node.value == value
+
+
+class Optimizer:
+    """Folds constant subtrees into literals and removes integer identities such as x * 1."""
+    def __init__(self):
+        self.eliminated = 0
+
+    def optimize(self, program: Program) -> Program:
+        optimized = Program(program.environment)
+        for statement in program.statements:
+            optimized.statements.append(self.optimize_statement(statement))
+        return optimized
+
+    def optimize_statement(self, statement: Statement) -> Statement:
+        if isinstance(statement, AssignStatement):
+            value = self.__optimize(statement.value)
+            if value is statement.value:
+                return statement
+            return AssignStatement(statement.name, value)
+        if not isinstance(statement, ExpressionStatement):
+            return statement
+        expression = self.__optimize(statement.expression)
+        if expression is statement.expression:
+            return statement
+        return ExpressionStatement(expression)
+
+    def __optimize(self, expression: Expression) -> Expression:
+        before = count_nodes(expression)
+        optimized = self.__optimize_expression(expression)
+        self.eliminated += before - count_nodes(optimized)
+        return optimized
+
+    def __optimize_expression(self, expression: Expression) -> Expression:
+        # Post-order walk with an explicit stack, so any depth is handled;
+        # a node is simplified once both of its operands have been
+        optimized = []
+        pending = [(expression, False)]
+        while pending:
+            node, operands_done = pending.pop()
+            if not isinstance(node, InfixExpression):
+                optimized.append(node)
+            elif not operands_done:
+                pending.append((node, True))
+                pending.append((node.right, False))
+                pending.append((node.left, False))
+            else:
+                right = optimized.pop()
+                left = optimized.pop()
+                optimized.append(self.__simplify(node, left, right))
+        return optimized[0]
+
+    def __simplify(self, expression: InfixExpression, left: Expression, right: Expression) -> Expression:
+        operator = expression.operator
+
+        if is_literal(left) and is_literal(right):
+            folded = self.__fold(left, operator, right)
+            if folded is not None:
+                return folded
+
+        # A power too large to fold can still be folded modulo a constant
+        if operator == '%' and isinstance(left, InfixExpression) and left.operator == '^' and is_literal(right):
+            if is_literal(left.left) and is_literal(left.right):
+                folded = self.__fold_power_mod(left.left, left.right, right)
+                if folded is not None:
+                    return folded
+
+        if operator in ('*', '^') and is_integer(right, 1):
+            return left
+        if operator == '*' and is_integer(left, 1):
+            return right
+        if operator in ('+', '-') and is_integer(right, 0):
+            return left
+        if operator == '+' and is_integer(left, 0):
+            return right
+
+        if left is expression.left and right is expression.right:
+            return expression
+        return InfixExpression(left, operator, right)
+
+    @staticmethod
+    def __fold(left: Expression, operator: str, right: Expression):
+        if isinstance(left.value, int) and isinstance(right.value, int):
+            if operator == '^' and right.value > 0 and left.value.bit_length() * right.value > MAX_FOLDED_BITS:
+                return None
+            if operator == '*' and left.value.bit_length() + right.value.bit_length() > MAX_FOLDED_BITS:
+                return None
+        try:
+            value = apply_infix(operator, left.value, right.value)
+        except (ArithmeticError, ValueError):
+            return None
+
+        if type(value) is int:
+            return IntegerLiteral(value, left.line_no, left.position)
+        if type(value) is float:
+            return FloatLiteral(value, left.line_no, left.position)
+        # e.g. a complex result of a fractional power of a negative number
+        return None
+
+    @staticmethod
+    def __fold_power_mod(base: Expression, exponent: Expression, modulus: Expression):
+        # Only where pow(a, b, m) gives the same result as pow(a, b) % m
+        if not (type(base.value) is int and type(exponent.value) is int and type(modulus.value) is int):
+            return None
+        if exponent.value < 0 or modulus.value == 0:
+            return None
+        return IntegerLiteral(pow(base.value, exponent.value, modulus.value), base.line_no, base.position)
+
+
+def optimize(program: Program) -> Program:
+    return Optimizer().optimize(program)
@@ -1,5 +1,6 @@
+from Environment import Environment
 from Lexer import Lexer
-from Token import Token, TokenType
+from Token import Token, TokenBuffer, TokenCursor, TokenType
 from enum import IntEnum
 from typing import Callable
 
@@ -20,26 +21,41 @@ class PrecedenceType(IntEnum):
       P_SET = 11
 
 PRECEDENCE = {
+    TokenType.EQ: PrecedenceType.P_EQUALS,
+    TokenType.LT: PrecedenceType.P_LESSGREATER,
+    TokenType.GT: PrecedenceType.P_LESSGREATER,
     TokenType.PLUS: PrecedenceType.P_SUM,
     TokenType.MINUS: PrecedenceType.P_SUM,
     TokenType.ASTERISK: PrecedenceType.P_PRODUCT,
     TokenType.SLASH: PrecedenceType.P_PRODUCT,
     TokenType.POWER: PrecedenceType.P_EXPONENT,
-    TokenType.MODULO: PrecedenceType.P_EXPONENT,
+    TokenType.MODULO: PrecedenceType.P_PRODUCT,
     TokenType.LPAREN: PrecedenceType.P_CALL,
     TokenType.LBRACE: PrecedenceType.P_GET,
 }
 
 class Parser:
-    def __init__(self, lexer: Lexer):
+    def __init__(self, lexer: Lexer, environment: Environment = None):
+        # Either a lexer, pulled one token at a time, or a filled TokenBuffer
         self.lexer = lexer
+        # Variables are resolved to slots of this environment as they are parsed
+        self.environment = environment if environment is not None else Environment()
+        self.tokens = lexer if isinstance(lexer, TokenBuffer) else None
+        self.token_index = 0
         self.errors = []
+        # Repeated literals of the program share one node
+        self.literals = LiteralTable()
+        # Function whose body is being parsed, and the index of each of its parameters
+        self.function = None
+        self.parameters = {}
         self.current_token = None
         self.peek_token = None
         self.prefix_parse_fns = {
+            TokenType.IDENTIFIER: self.__parse_identifier,
             TokenType.INT: self.__parse_integer_literal,
             TokenType.FLOAT: self.__parse_float_literal,
             TokenType.LPAREN: self.__parse_grouped_expression,
+            TokenType.IF: self.__parse_if_expression,
         }
         self.infix_parse_fns = {
             TokenType.PLUS: self.__parse_infix_expression,
@@ -48,6 +64,9 @@ class Parser:
             TokenType.SLASH: self.__parse_infix_expression,
             TokenType.POWER: self.__parse_infix_expression,
             TokenType.MODULO: self.__parse_infix_expression,
+            TokenType.EQ: self.__parse_infix_expression,
+            TokenType.LT: self.__parse_infix_expression,
+            TokenType.GT: self.__parse_infix_expression,
             TokenType.LPAREN: self.__parse_call_expression,
             TokenType.LBRACE: self.__parse_get_expression,
         }
@@ -63,8 +82,21 @@ class Parser:
         """
         Fixed recursive method by renaming and updating the implementation
         """
+        if self.tokens is None:
+            self.current_token = self.peek_token
+            self.peek_token = self.lexer.next_token()
+            return
+
+        # Only the current and peek tokens are ever live, so two cursors into
+        # the buffer are swapped instead of materializing a Token per step
+        cursor = self.current_token
         self.current_token = self.peek_token
-        self.peek_token = self.lexer.next_token()
+        if cursor is None:
+            cursor = TokenCursor(self.tokens, self.token_index)
+        else:
+            cursor.seek(self.token_index)
+        self.token_index += 1
+        self.peek_token = cursor
 
     # Alias for compatibility with existing code
     def __next__Token(self):
@@ -95,46 +127,163 @@ class Parser:
         return None
 
     def parse_program(self):
-        program = Program()
+        program = Program(self.environment)
+        for statement in self.parse_statements():
+            program.statements.append(statement)
+
+        return program
+
+    def parse_statements(self):
+        """
+        Yields each statement as soon as it has been parsed, so callers can
+        execute a program without holding all of it in memory. Statements
+        that fail to parse are skipped and recorded in `errors`.
+        """
         while self.current_token.type != TokenType.EOF:
+            if self.current_token.type == TokenType.SEMICOLON:
+                self.__next_token()
+                continue
             statement = self.__parse_statement()
             if statement is not None:
-                program.statements.append(statement)
+                yield statement
             self.__next_token()
 
-        return program
-
     def __parse_statement(self):
+       if self.current_token.type == TokenType.IDENTIFIER and self.__peek__Token(TokenType.ASSIGN):
+           return self.__parse_assign_statement()
+       if self.current_token.type == TokenType.FN:
+           return self.__parse_function_statement()
        return self.__parse_expression_statement()
 
+    def __parse_function_statement(self):
+        if not self.__expect__Token(TokenType.IDENTIFIER):
+            return None
+        token = self.current_token
+        name = Identifier(token.literal, self.environment, token.line_no, token.position)
+        if not self.__expect__Token(TokenType.LPAREN):
+            return None
+
+        parameters = []
+        if self.__peek__Token(TokenType.RPAREN):
+            self.__next_token()
+        else:
+            while True:
+                if not self.__expect__Token(TokenType.IDENTIFIER):
+                    return None
+                if self.current_token.literal in parameters:
+                    self.errors.append(f"Duplicate parameter: {self.current_token.literal}")
+                    return None
+                parameters.append(self.current_token.literal)
+                if not self.__peek__Token(TokenType.COMMA):
+                    break
+                self.__next_token()
+            if not self.__expect__Token(TokenType.RPAREN):
+                return None
+        if not self.__expect__Token(TokenType.ASSIGN):
+            return None
+        self.__next_token()
+
+        function = Function(name.name, parameters, self.environment)
+        outer = self.function, self.parameters
+        self.function = function
+        self.parameters = {parameter: index for index, parameter in enumerate(parameters)}
+        try:
+            body = self.__parse_expression(PrecedenceType.P_LOWEST)
+        finally:
+            self.function, self.parameters = outer
+        if body is None:
+            return None
+        function.body = body
+        mark_tail_calls(body)
+
+        if self.__peek__Token(TokenType.SEMICOLON):
+            self.__next_token()
+
+        return FunctionStatement(name, function)
+
+    def __parse_assign_statement(self):
+        name = self.__parse_identifier()
+        self.__next_token()
+        self.__next_token()
+        value = self.__parse_expression(PrecedenceType.P_LOWEST)
+        if value is None:
+            return None
+
+        if self.__peek__Token(TokenType.SEMICOLON):
+            self.__next_token()
+
+        return AssignStatement(name, value)
+
     def __parse_expression_statement(self):
         expression = self.__parse_expression(PrecedenceType.P_LOWEST)
         if expression is None:
             return None
 
-        if self.current_token.type == TokenType.SEMICOLON:
+        if self.__peek__Token(TokenType.SEMICOLON):
             self.__next_token()
 
         smt = ExpressionStatement(expression)
         return smt
 
     def __parse_expression(self, precedence: PrecedenceType):
-        prefix = self.prefix_parse_fns.get(self.current_token.type)
-        if prefix is None:
-            self.__no_prefix__parse(self.current_token)
-            return None
-
-        left_node = prefix()
-        if left_node is None:
-            return None
-
-        while not self.__peek__Token(TokenType.SEMICOLON) and precedence < self.__next__precedence():
-            infix = self.infix_parse_fns.get(self.peek_token.type)
-            if infix is None:
-                return left_node
-            self.__next_token()
-            left_node = infix(left_node)
-        return left_node
+        """Pratt parser driven by an explicit stack, so nesting depth is only limited by memory."""
+        # One (left, operator, precedence) entry per level waiting for its
+        # operand; operator is None for an open parenthesis
+        pending = []
+        prefix_parse_fns = self.prefix_parse_fns
+        infix_parse_fns = self.infix_parse_fns
+        parse_grouped = self.__parse_grouped_expression
+        parse_infix = self.__parse_infix_expression
+        while True:
+            prefix = prefix_parse_fns.get(self.current_token.type)
+            if prefix == parse_grouped:
+                self.__next_token()
+                pending.append((None, None, precedence))
+                precedence = PrecedenceType.P_LOWEST
+                continue
+
+            if prefix is None:
+                self.__no_prefix__parse(self.current_token)
+                left_node = None
+            else:
+                left_node = prefix()
+            # A failed prefix ends its level at once, a failed infix does not
+            looping = left_node is not None
+
+            while True:
+                if looping:
+                    right_precedence = None
+                    while True:
+                        # Inlined __peek__Token and __next__precedence
+                        peek_type = self.peek_token.type
+                        next_precedence = PRECEDENCE.get(peek_type, PrecedenceType.P_LOWEST)
+                        if peek_type == TokenType.SEMICOLON or precedence >= next_precedence:
+                            break
+                        infix = infix_parse_fns.get(peek_type)
+                        if infix is None:
+                            break
+                        self.__next_token()
+                        if infix == parse_infix:
+                            pending.append((left_node, self.current_token.literal, precedence))
+                            right_precedence = next_precedence
+                            self.__next_token()
+                            break
+                        left_node = infix(left_node)
+                    if right_precedence is not None:
+                        precedence = right_precedence
+                        break
+
+                if not pending:
+                    return left_node
+                left, operator, precedence = pending.pop()
+                if operator is None:
+                    if not self.__expect__Token(TokenType.RPAREN):
+                        left_node = None
+                    looping = left_node is not None
+                else:
+                    if left_node is not None:
+                        left_node = InfixExpression(left, operator, left_node)
+                    looping = True
 
     def __parse_infix_expression(self, left_node: Expression):
         # Create infix expression with correct parameters matching the constructor in AST.py
@@ -154,6 +303,13 @@ class Parser:
             return None
         return expression
 
+    def __parse_identifier(self):
+        token = self.current_token
+        index = self.parameters.get(token.literal)
+        if index is not None:
+            return Parameter(token.literal, self.function, index, token.line_no, token.position)
+        return Identifier(token.literal, self.environment, token.line_no, token.position)
+
     def __parse_integer_literal(self):
         if self.current_token.type != TokenType.INT:
             self.__peek__error()
@@ -165,8 +321,7 @@ class Parser:
             self.errors.append(f"Invalid integer literal: {self.current_token.literal}")
             return None
 
-        integer_literal = IntegerLiteral(value, self.current_token.line_no, self.current_token.position)
-        return integer_literal
+        return self.literals.integer(value, self.current_token.line_no, self.current_token.position)
 
     def __parse_float_literal(self):
         """
@@ -182,12 +337,44 @@ class Parser:
             self.errors.append(f"Invalid float literal: {self.current_token.literal}")
             return None
 
-        float_literal = FloatLiteral(value)
-        return float_literal
+        return self.literals.float(value, self.current_token.line_no, self.current_token.position)
 
     def __parse_call_expression(self, function: Expression):
-        self.errors.append("Function calls not yet implemented")
-        return function
+        arguments = []
+        if self.__peek__Token(TokenType.RPAREN):
+            self.__next_token()
+            return CallExpression(function, arguments)
+
+        self.__next_token()
+        while True:
+            argument = self.__parse_expression(PrecedenceType.P_LOWEST)
+            if argument is None:
+                return None
+            arguments.append(argument)
+            if not self.__peek__Token(TokenType.COMMA):
+                break
+            self.__next_token()
+            self.__next_token()
+        if not self.__expect__Token(TokenType.RPAREN):
+            return None
+        return CallExpression(function, arguments)
+
+    def __parse_if_expression(self):
+        if not self.__expect__Token(TokenType.LPAREN):
+            return None
+        self.__next_token()
+        condition = self.__parse_expression(PrecedenceType.P_LOWEST)
+        if condition is None or not self.__expect__Token(TokenType.RPAREN):
+            return None
+        self.__next_token()
+        consequence = self.__parse_expression(PrecedenceType.P_LOWEST)
+        if consequence is None or not self.__expect__Token(TokenType.ELSE):
+            return None
+        self.__next_token()
+        alternative = self.__parse_expression(PrecedenceType.P_LOWEST)
+        if alternative is None:
+            return None
+        return IfExpression(condition, consequence, alternative)
 
     def __parse_get_expression(self, object_expr: Expression):
         self.errors.append("Property access not yet implemented")
@@ -0,0 +1,375 @@
+import struct
+import sys
+from array import array
+
+from AST import *
+from Environment import Environment
+
+MAGIC = b"HAXB"
+# Bump when the encoding changes; decode() refuses any other version
+FORMAT_VERSION = 2
+
+# magic, format version, typecode of the argument array, constant count,
+# opcode count, argument count
+HEADER = struct.Struct("<4sHBxIII")
+INT64 = struct.Struct("<q")
+FLOAT64 = struct.Struct("<d")
+LENGTH = struct.Struct("<I")
+
+# Constant pool entry tags
+INT_CONSTANT = 0
+BIG_INT_CONSTANT = 1
+FLOAT_CONSTANT = 2
+STRING_CONSTANT = 3
+
+# Opcodes, one byte per node in preorder. Each takes a fixed number of
+# arguments from the argument array, except FUNCTION, which is followed by
+# its parameter names. Infix expressions take no argument: the operator is
+# part of the opcode, INFIX plus its index in OPERATORS. Nodes built from a
+# single token keep its line and position
+NONE = 0
+PROGRAM = 1                 # statement count
+EXPRESSION_STATEMENT = 2
+SHARED_STATEMENT = 3
+ASSIGN = 4                  # name, line, position
+FUNCTION = 5                # name, line, position, parameter count, names
+INT = 6                     # value, line, position
+FLOAT = 7                   # value, line, position
+IDENTIFIER = 8              # name, line, position
+PARAMETER = 9               # index in the enclosing function, line, position
+CALL = 10                   # argument count
+TAIL_CALL = 11              # argument count
+IF = 12
+SHARED = 13
+SHARED_REF = 14             # index of an earlier SHARED, in preorder
+INFIX = 15
+
+OPERATORS = ('+', '-', '*', '/', '^', '%', '==', '<', '>')
+INFIX_OPCODES = {operator: INFIX + index for index, operator in enumerate(OPERATORS)}
+
+# Children each interior opcode is followed by, if not given by an argument
+FIXED_CHILDREN = {EXPRESSION_STATEMENT: 1, SHARED_STATEMENT: 1, ASSIGN: 1, FUNCTION: 1, IF: 3, SHARED: 1}
+
+
+class Encoder:
+    def __init__(self):
+        self.constants = []
+        # Ints, the most common constants, are also looked up by value alone
+        self.ints = {}
+        self.others = {}
+        self.ops = bytearray()
+        self.args = []
+        self.shared = {}
+
+    def constant(self, value) -> int:
+        if type(value) is int:
+            index, key = self.ints, value
+        else:
+            index, key = self.others, literal_key(value)
+        position = index.get(key)
+        if position is None:
+            position = index[key] = len(self.constants)
+            self.constants.append(value)
+        return position
+
+    def encode(self, root: Node) -> bytes:
+        ops = self.ops
+        args = self.args
+        constant = self.constant
+        ints = self.ints
+        # Children are pushed in reverse so they pop in order
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            cls = node.__class__
+            if cls is InfixExpression:
+                ops.append(INFIX_OPCODES[node.operator])
+                pending.append(node.right)
+                pending.append(node.left)
+            elif cls is IntegerLiteral:
+                # The most common node, so the int pool is looked up inline
+                index = ints.get(node.value)
+                if index is None:
+                    index = constant(node.value)
+                ops.append(INT)
+                args.extend((index, node.line_no, node.position))
+            elif cls is FloatLiteral:
+                ops.append(FLOAT)
+                args.extend((constant(node.value), node.line_no, node.position))
+            elif cls is Identifier:
+                ops.append(IDENTIFIER)
+                args.extend((constant(node.name), node.line_no, node.position))
+            elif cls is Parameter:
+                ops.append(PARAMETER)
+                args.extend((node.index, node.line_no, node.position))
+            elif cls is SharedExpression:
+                index = self.shared.get(node)
+                if index is not None:
+                    ops.append(SHARED_REF)
+                    args.append(index)
+                else:
+                    self.shared[node] = len(self.shared)
+                    ops.append(SHARED)
+                    pending.append(node.expression)
+            elif cls is ExpressionStatement or cls is SharedStatement:
+                ops.append(EXPRESSION_STATEMENT if cls is ExpressionStatement else SHARED_STATEMENT)
+                pending.append(node.expression)
+            elif cls is AssignStatement:
+                name = node.name
+                ops.append(ASSIGN)
+                args.extend((constant(name.name), name.line_no, name.position))
+                pending.append(node.value)
+            elif cls is CallExpression:
+                ops.append(TAIL_CALL if node.tail else CALL)
+                args.append(len(node.arguments))
+                pending.extend(reversed(node.arguments))
+                pending.append(node.function)
+            elif cls is IfExpression:
+                ops.append(IF)
+                pending.extend((node.alternative, node.consequence, node.condition))
+            elif cls is FunctionStatement:
+                name = node.name
+                function = node.function
+                ops.append(FUNCTION)
+                args.extend((constant(name.name), name.line_no, name.position, len(function.parameters)))
+                args.extend(map(constant, function.parameters))
+                pending.append(function.body)
+            elif cls is Program:
+                ops.append(PROGRAM)
+                args.append(len(node.statements))
+                pending.extend(reversed(node.statements))
+            elif node is None:
+                # The parser can leave a failed operand as None
+                ops.append(NONE)
+            else:
+                raise ValueError(f"Cannot encode node: {node.type()}")
+        return self.__pack()
+
+    def __pack(self) -> bytes:
+        typecode = 'H' if not self.args or max(self.args) <= 0xFFFF else 'I'
+        args = array(typecode, self.args)
+        if sys.byteorder != "little":
+            args.byteswap()
+
+        pool = bytearray()
+        for value in self.constants:
+            if type(value) is int:
+                if -(1 << 63) <= value < (1 << 63):
+                    pool.append(INT_CONSTANT)
+                    pool += INT64.pack(value)
+                else:
+                    data = value.to_bytes(value.bit_length() // 8 + 1, "little", signed=True)
+                    pool.append(BIG_INT_CONSTANT)
+                    pool += LENGTH.pack(len(data))
+                    pool += data
+            elif type(value) is float:
+                pool.append(FLOAT_CONSTANT)
+                pool += FLOAT64.pack(value)
+            else:
+                data = value.encode("utf-8")
+                pool.append(STRING_CONSTANT)
+                pool += LENGTH.pack(len(data))
+                pool += data
+
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, ord(typecode), len(self.constants), len(self.ops), len(args))
+        # The argument array starts at a multiple of its item size
+        padding = -(len(header) + len(pool) + len(self.ops)) % args.itemsize
+        return b"".join((header, pool, self.ops, bytes(padding), args.tobytes()))
+
+
+def encode(node: Node) -> bytes:
+    """
+    Encodes a Program, statement or expression into the compact binary form
+    read by decode(). Variables are stored by name, so the result does not
+    depend on any Environment.
+    """
+    return Encoder().encode(node)
+
+
+def _read_constants(view: memoryview, offset: int, count: int):
+    constants = []
+    for _ in range(count):
+        tag = view[offset]
+        offset += 1
+        if tag == INT_CONSTANT:
+            constants.append(INT64.unpack_from(view, offset)[0])
+            offset += INT64.size
+        elif tag == FLOAT_CONSTANT:
+            constants.append(FLOAT64.unpack_from(view, offset)[0])
+            offset += FLOAT64.size
+        else:
+            length = LENGTH.unpack_from(view, offset)[0]
+            offset += LENGTH.size
+            data = view[offset:offset + length]
+            if len(data) != length:
+                raise ValueError("Truncated binary AST")
+            if tag == BIG_INT_CONSTANT:
+                constants.append(int.from_bytes(data, "little", signed=True))
+            elif tag == STRING_CONSTANT:
+                constants.append(str(data, "utf-8"))
+            else:
+                raise ValueError(f"Unknown constant tag: {tag}")
+            offset += length
+    return constants, offset
+
+
+def decode(data, environment: Environment = None) -> Node:
+    """
+    Rebuilds the node encoded in `data`, which can be bytes or any buffer,
+    such as a memoryview into a larger file; it is read in place. Variables
+    are resolved in `environment`, or in a new one.
+    """
+    if environment is None:
+        environment = Environment()
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    try:
+        magic, version, typecode, constant_count, op_count, arg_count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary Haxian AST")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary AST version: {version}")
+        typecode = chr(typecode)
+        constants, offset = _read_constants(view, HEADER.size, constant_count)
+        ops = view[offset:offset + op_count]
+        offset += op_count
+        itemsize = 2 if typecode == 'H' else 4
+        offset += -offset % itemsize
+        args = view[offset:offset + arg_count * itemsize]
+        if len(ops) != op_count or len(args) != arg_count * itemsize:
+            raise ValueError("Truncated binary AST")
+        if offset + len(args) != len(view):
+            raise ValueError("Trailing data in binary AST")
+        if sys.byteorder == "little":
+            args = args.cast(typecode)
+        else:
+            args = array(typecode, args)
+            args.byteswap()
+        return _build(ops, args, constants, environment)
+    except (struct.error, IndexError):
+        raise ValueError("Truncated binary AST") from None
+    except (AttributeError, TypeError):
+        # e.g. a statement where an expression belongs
+        raise ValueError("Malformed binary AST") from None
+
+
+def _build(ops, args, constants: list, environment: Environment) -> Node:
+    # Interior nodes wait on `frames` as [opcode, children still missing,
+    # children, argument] until their children are built, so any depth decodes
+    frames = []
+    shared = []
+    functions = []
+    # Literals with the same value and location were one shared node, as
+    # the parser's LiteralTable makes them, and are decoded into one again
+    integers = {}
+    floats = {}
+    position = 0
+    infix_end = INFIX + len(OPERATORS)
+    for index, op in enumerate(ops):
+        if op >= INFIX:
+            if op >= infix_end:
+                raise ValueError(f"Unknown opcode: {op}")
+            frames.append([INFIX, 2, [], OPERATORS[op - INFIX]])
+            continue
+        if op == INT:
+            key = (args[position], args[position + 1], args[position + 2])
+            node = integers.get(key)
+            if node is None:
+                node = integers[key] = IntegerLiteral(constants[key[0]], key[1], key[2])
+            position += 3
+        elif op == FLOAT:
+            key = (args[position], args[position + 1], args[position + 2])
+            node = floats.get(key)
+            if node is None:
+                node = floats[key] = FloatLiteral(constants[key[0]], key[1], key[2])
+            position += 3
+        elif op == IDENTIFIER:
+            node = Identifier(constants[args[position]], environment, args[position + 1], args[position + 2])
+            position += 3
+        elif op == PARAMETER:
+            function = functions[-1]
+            index = args[position]
+            node = Parameter(function.parameters[index], function, index, args[position + 1], args[position + 2])
+            position += 3
+        elif op == SHARED_REF:
+            node = shared[args[position]]
+            position += 1
+        elif op == NONE:
+            node = None
+        else:
+            if op == PROGRAM or op == CALL or op == TAIL_CALL:
+                needed = args[position] + (op != PROGRAM)
+                argument = None
+                position += 1
+            elif op == ASSIGN:
+                # Names are resolved before the value, as the parser does
+                needed = 1
+                argument = Identifier(constants[args[position]], environment, args[position + 1], args[position + 2])
+                position += 3
+            elif op == FUNCTION:
+                name = Identifier(constants[args[position]], environment, args[position + 1], args[position + 2])
+                count = args[position + 3]
+                parameters = [constants[index] for index in args[position + 4:position + 4 + count]]
+                function = Function(name.name, parameters, environment)
+                functions.append(function)
+                argument = FunctionStatement(name, function)
+                needed = 1
+                position += 4 + count
+            elif op == SHARED:
+                needed = 1
+                argument = len(shared)
+                shared.append(None)
+            else:
+                needed = FIXED_CHILDREN.get(op)
+                if needed is None:
+                    raise ValueError(f"Unknown opcode: {op}")
+                argument = None
+            if needed:
+                frames.append([op, needed, [], argument])
+                continue
+            # Only an empty Program or a call without arguments gets here
+            node = _finish(op, [], argument, shared, functions, environment)
+
+        while frames:
+            frame = frames[-1]
+            children = frame[2]
+            children.append(node)
+            frame[1] -= 1
+            if frame[1]:
+                break
+            frames.pop()
+            if frame[0] == INFIX:
+                node = InfixExpression(children[0], frame[3], children[1])
+            else:
+                node = _finish(frame[0], children, frame[3], shared, functions, environment)
+        else:
+            if index + 1 != len(ops) or position != len(args):
+                raise ValueError("Trailing data in binary AST")
+            return node
+    raise ValueError("Truncated binary AST")
+
+
+def _finish(op: int, children: list, argument, shared: list, functions: list, environment: Environment) -> Node:
+    if op == EXPRESSION_STATEMENT:
+        return ExpressionStatement(children[0])
+    if op == SHARED_STATEMENT:
+        return SharedStatement(children[0])
+    if op == SHARED:
+        node = shared[argument] = SharedExpression(children[0])
+        return node
+    if op == IF:
+        return IfExpression(*children)
+    if op == CALL or op == TAIL_CALL:
+        node = CallExpression(children[0], children[1:])
+        node.tail = op == TAIL_CALL
+        return node
+    if op == ASSIGN:
+        return AssignStatement(argument, children[0])
+    if op == FUNCTION:
+        functions.pop()
+        argument.function.body = children[0]
+        return argument
+    program = Program(environment)
+    program.statements = children
+    return program
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from AST import (AssignStatement, CallExpression, ExpressionStatement, FunctionStatement, IfExpression, InfixExpression,
+                 IntegerLiteral, Program, SharedExpression)
+from Batch import BatchResult, evaluate_expression, worker_cache
+from Budget import DEFAULT_MAX_BITS, Budget, add_budget_arguments, budget_from_args
+
+DEFAULT_PORT = 7341
+
+# Longest request line accepted
+MAX_LINE_BYTES = 1 << 20
+
+# Requests of one connection waiting for a worker before the server stops
+# reading from it, which pushes back on the client through TCP flow control
+MAX_IN_FLIGHT = 64
+
+# Evaluations handed to the pool per worker before connections wait for one
+QUEUED_PER_WORKER = 4
+
+# Programs at most this large and without calls are evaluated on the event
+# loop, as sending them to a worker costs more than evaluating them, if their
+# powers have literal exponents whose product stays within MAX_INLINE_GROWTH,
+# which bounds how many times larger than its operands a result can get
+MAX_INLINE_NODES = 256
+MAX_INLINE_GROWTH = 64
+
+# Sources whose routing is remembered before the table is cleared
+MAX_ROUTES = 4096
+
+# Budget of every evaluation unless configured otherwise, so one request
+# cannot stall a worker or the event loop for everyone else
+DEFAULT_TIMEOUT = 10.0
+
+
+def is_cheap(program: Program) -> bool:
+    nodes = 0
+    growth = 1
+    pending = list(program.statements)
+    while pending:
+        node = pending.pop()
+        nodes += 1
+        if nodes > MAX_INLINE_NODES or isinstance(node, (CallExpression, FunctionStatement)):
+            return False
+        if isinstance(node, InfixExpression):
+            if node.operator == '^':
+                exponent = node.right
+                if not isinstance(exponent, IntegerLiteral) or exponent.value < 0:
+                    return False
+                growth *= max(exponent.value, 1)
+                if growth > MAX_INLINE_GROWTH:
+                    return False
+            pending.append(node.right)
+            pending.append(node.left)
+        elif isinstance(node, (ExpressionStatement, SharedExpression)):
+            pending.append(node.expression)
+        elif isinstance(node, AssignStatement):
+            pending.append(node.value)
+        elif isinstance(node, IfExpression):
+            pending.extend((node.condition, node.consequence, node.alternative))
+    return True
+
+
+def parse_request(request) -> tuple:
+    """Returns the expression and bindings of a decoded request line."""
+    if not isinstance(request, dict):
+        raise ValueError("Request must be a JSON object")
+    expression = request.get("expression")
+    if not isinstance(expression, str):
+        raise ValueError('Request needs an "expression" string')
+    bindings = request.get("bindings") or None
+    if bindings is not None:
+        if not isinstance(bindings, dict) or not all(type(value) in (int, float) for value in bindings.values()):
+            raise ValueError('"bindings" must map names to numbers')
+    return expression, bindings
+
+
+def encode_response(request_id, result: BatchResult) -> bytes:
+    if result.error is None:
+        value = result.value
+        # Anything JSON has no number for, e.g. a complex power or a function
+        if value is not None and type(value) is not int and type(value) is not float:
+            value = str(value)
+        try:
+            return (json.dumps({"id": request_id, "value": value}) + "\n").encode()
+        except ValueError as e:
+            # e.g. an int with more digits than Python converts to text
+            result = BatchResult(error=str(e))
+    return (json.dumps({"id": request_id, "error": result.error}) + "\n").encode()
+
+
+class EvaluationServer:
+    """Evaluates independent newline-delimited JSON requests, cheap ones inline and the rest in a pool."""
+    def __init__(self, workers: int = None, budget: Budget = None):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.budget = budget
+        self.pool = None
+        self.pool_slots = None
+        self.routes = {}
+
+    async def start(self, host: str = None, port: int = DEFAULT_PORT, path: str = None) -> asyncio.AbstractServer:
+        """Listens on the Unix socket `path` if given, or else on host and port."""
+        if self.workers:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.pool_slots = asyncio.Semaphore(self.workers * QUEUED_PER_WORKER)
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path, limit=MAX_LINE_BYTES)
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_BYTES)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is over MAX_LINE_BYTES, and the rest of the
+                    # stream cannot be split into requests reliably
+                    await self.__send(writer, lock, encode_response(None, BatchResult(error="Request line too long")))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if isinstance(request, dict):
+                        request_id = request.get("id")
+                    source, bindings = parse_request(request)
+                except ValueError as e:
+                    await self.__send(writer, lock, encode_response(request_id, BatchResult(error=str(e))))
+                    continue
+
+                if self.__inline(source):
+                    await self.__send(writer, lock, encode_response(request_id, evaluate_expression(source, bindings, self.budget)))
+                    continue
+
+                await in_flight.acquire()
+                task = asyncio.create_task(self.__evaluate_pooled(request_id, source, bindings, writer, lock, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def __inline(self, source: str) -> bool:
+        if self.pool is None:
+            return True
+        cheap = self.routes.get(source)
+        if cheap is None:
+            entry = worker_cache().get(source)
+            # Parse errors are reported as quickly inline as anywhere else
+            cheap = bool(entry.errors) or is_cheap(entry.program)
+            if len(self.routes) >= MAX_ROUTES:
+                self.routes.clear()
+            self.routes[source] = cheap
+        return cheap
+
+    async def __evaluate_pooled(self, request_id, source: str, bindings: dict, writer: asyncio.StreamWriter,
+                                lock: asyncio.Lock, in_flight: asyncio.Semaphore):
+        try:
+            async with self.pool_slots:
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(self.pool, evaluate_expression, source, bindings, self.budget)
+                except Exception as e:
+                    # e.g. a worker process that died
+                    result = BatchResult(error=f"Worker failed: {e}")
+            await self.__send(writer, lock, encode_response(request_id, result))
+        finally:
+            in_flight.release()
+
+    @staticmethod
+    async def __send(writer: asyncio.StreamWriter, lock: asyncio.Lock, data: bytes):
+        async with lock:
+            writer.write(data)
+            await writer.drain()
+
+
+async def serve(server: EvaluationServer, host: str, port: int, path: str = None):
+    listener = await server.start(host, port, path)
+    try:
+        address = path or ", ".join(str(socket.getsockname()) for socket in listener.sockets)
+        print(f"Serving on {address}", flush=True)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv: List[str] = None):
+    arg_parser = argparse.ArgumentParser(description="Serve Haxian evaluations as JSON lines over TCP or a Unix socket.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument("--unix", metavar="PATH", default=None, help="listen on this Unix socket instead of TCP")
+    arg_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, 0 to evaluate everything inline")
+    add_budget_arguments(arg_parser, max_bits=DEFAULT_MAX_BITS, timeout=DEFAULT_TIMEOUT)
+    args = arg_parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(EvaluationServer(args.workers, budget_from_args(args)), args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
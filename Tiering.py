@@ -0,0 +1,280 @@
+import math
+from typing import Callable, Optional
+
+from AST import (MAX_RECURSIVE_DEPTH, AssignStatement, CallExpression, DeferredPower, ExpressionStatement, FloatLiteral,
+                 Function, FunctionStatement, Identifier, IfExpression, InfixExpression, IntegerLiteral, Program,
+                 SharedExpression, SharedStatement, call_function, defer_power)
+from Environment import UNBOUND
+
+# Programs with more nodes than this stay interpreted, as compiling them
+# costs more than most of them are ever evaluated
+MAX_PROMOTED_NODES = 4096
+
+# Every nested if indents the generated source one more level, and Python
+# allows at most 100
+MAX_PROMOTED_NESTING = 64
+
+# Larger ints are bound by name instead of written into the source, which
+# could run into the limit on converting ints to text
+MAX_INLINE_INT_BITS = 64
+
+# Programs compiled and programs that could not be, since the process started
+promoted = 0
+rejected = 0
+
+# Steps of CodeGenerator.__expression()
+_VISIT = 0
+_APPLY = 1
+_DEFER = 2
+_MODULO = 3
+_CHECK_CALL = 4
+_CALL = 5
+_SHARE = 6
+_IF = 7
+_ELSE = 8
+_END_IF = 9
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def stats() -> dict:
+    return {"promoted": promoted, "rejected": rejected}
+
+
+class CodeGenerator:
+    """Translates a Program into straight-line Python source for `evaluate(budget)`."""
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+        self.__constants = {}
+        self.__known = {}
+        self.__temporaries = 0
+        self.__nodes = 0
+        self.__indent = 1
+        self.__variables = {}
+        self.__shared = {}
+
+    def generate(self, program: Program) -> str:
+        self.lines = ["def evaluate(budget):"]
+        self.namespace = {"UNBOUND": UNBOUND, "Function": Function, "DeferredPower": DeferredPower,
+                          "defer_power": defer_power, "call_function": call_function}
+        statements = program.statements
+        result = "None"
+        for index, statement in enumerate(statements):
+            last = index == len(statements) - 1
+            # Program.evaluate() only runs the statements before the last one for their effects
+            if not last and not statement.side_effects:
+                continue
+            self.__shared = {}
+            if statement.__class__ is ExpressionStatement or statement.__class__ is SharedStatement:
+                value = self.__expression(statement.expression)
+            elif statement.__class__ is AssignStatement:
+                value = self.__expression(statement.value)
+                self.__store(statement.name, value)
+            elif statement.__class__ is FunctionStatement:
+                value = self.__bind(statement.function)
+                self.__store(statement.name, value)
+            else:
+                raise _Unsupported(statement)
+            if last:
+                result = value
+        self.__emit(f"return {result}")
+        return "\n".join(self.lines) + "\n"
+
+    def __emit(self, line: str):
+        self.lines.append("    " * self.__indent + line)
+
+    def __temporary(self) -> str:
+        self.__temporaries += 1
+        return f"t{self.__temporaries}"
+
+    def __bind(self, value) -> str:
+        name = self.__constants.get(id(value))
+        if name is None:
+            name = self.__constants[id(value)] = f"k{len(self.__constants)}"
+            self.namespace[name] = value
+            self.__known[name] = value
+        return name
+
+    def __literal(self, value) -> str:
+        if (value.__class__ is int and value.bit_length() <= MAX_INLINE_INT_BITS) or \
+                (value.__class__ is float and math.isfinite(value)):
+            text = repr(value)
+            if text.startswith("-"):
+                text = f"({text})"
+            self.__known[text] = value
+            return text
+        return self.__bind(value)
+
+    def __store(self, name: Identifier, value: str):
+        values = self.__bind(name.values)
+        self.__emit(f"{values}[{name.slot}] = {value}")
+        self.__emit(f"{self.__bind(name.environment)}.version += 1")
+        self.__variables[values, name.slot] = value
+
+    def __variable(self, node: Identifier) -> str:
+        key = (self.__bind(node.values), node.slot)
+        operand = self.__variables.get(key)
+        if operand is None:
+            operand = self.__variables[key] = self.__temporary()
+            self.__emit(f"{operand} = {key[0]}[{node.slot}]")
+            self.__emit(f"if {operand} is UNBOUND:")
+            self.__emit(f"    raise ValueError({'Undefined variable: ' + node.name!r})")
+        return operand
+
+    def __charge(self, *nodes: InfixExpression):
+        # Where InfixExpression.evaluate() charges them, before the operands
+        # are evaluated: one step per operator and per operand that is not an operator
+        steps = sum(1 + (node.left.__class__ is not InfixExpression) + (node.right.__class__ is not InfixExpression) for node in nodes)
+        self.__emit(f"if budget is not None: budget.step({steps})")
+
+    def __apply(self, operator: str, left: str, right: str) -> str:
+        target = self.__temporary()
+        if operator == '+' or operator == '-' or operator == '%':
+            self.__emit(f"{target} = {left} {operator} {right}")
+        elif operator == '*':
+            self.__emit(f"if budget is not None: budget.check('*', {left}, {right})")
+            self.__emit(f"{target} = {left} * {right}")
+        elif operator == '/':
+            if right not in self.__known or self.__known[right] == 0:
+                self.__emit(f"if {right} == 0:")
+                self.__emit("    raise ValueError('Division by zero')")
+            self.__emit(f"{target} = {left} / {right}")
+        elif operator == '^':
+            self.__emit(f"if budget is not None: budget.check('^', {left}, {right})")
+            self.__emit(f"{target} = pow({left}, {right})")
+        elif operator == '<' or operator == '>' or operator == '==':
+            self.__emit(f"{target} = 1 if {left} {operator} {right} else 0")
+        else:
+            raise _Unsupported(operator)
+        return target
+
+    def __expression(self, root) -> str:
+        operands = []
+        pending = [(_VISIT, root, None)]
+        while pending:
+            step, node, data = pending.pop()
+            if step == _VISIT:
+                self.__nodes += 1
+                if self.__nodes > MAX_PROMOTED_NODES:
+                    raise _Unsupported("too many nodes")
+                cls = node.__class__
+                if cls is IntegerLiteral or cls is FloatLiteral:
+                    operands.append(self.__literal(node.value))
+                elif cls is Identifier:
+                    operands.append(self.__variable(node))
+                elif cls is InfixExpression:
+                    # Deeper trees are evaluated by evaluate_deep(), which charges steps in another order
+                    if node.depth > MAX_RECURSIVE_DEPTH:
+                        raise _Unsupported("too deep")
+                    left = node.left
+                    if node.operator == '%' and left.__class__ is InfixExpression and left.operator == '^':
+                        self.__nodes += 1
+                        self.__charge(node, left)
+                        pending.append((_MODULO, node, None))
+                        pending.append((_VISIT, node.right, None))
+                        pending.append((_DEFER, left, None))
+                        pending.append((_VISIT, left.right, None))
+                        pending.append((_VISIT, left.left, None))
+                    else:
+                        self.__charge(node)
+                        pending.append((_APPLY, node, None))
+                        pending.append((_VISIT, node.right, None))
+                        pending.append((_VISIT, left, None))
+                elif cls is SharedExpression:
+                    operand = self.__shared.get(node)
+                    if operand is not None:
+                        operands.append(operand)
+                    else:
+                        pending.append((_SHARE, node, None))
+                        pending.append((_VISIT, node.expression, None))
+                elif cls is IfExpression:
+                    if self.__indent > MAX_PROMOTED_NESTING:
+                        raise _Unsupported("nested too deeply")
+                    pending.append((_IF, node, None))
+                    pending.append((_VISIT, node.condition, None))
+                elif cls is CallExpression and not node.tail:
+                    pending.append((_CALL, node, None))
+                    for argument in reversed(node.arguments):
+                        pending.append((_VISIT, argument, None))
+                    pending.append((_CHECK_CALL, node, None))
+                    pending.append((_VISIT, node.function, None))
+                else:
+                    raise _Unsupported(node)
+            elif step == _APPLY:
+                right = operands.pop()
+                operands.append(self.__apply(node.operator, operands.pop(), right))
+            elif step == _DEFER:
+                exponent = operands.pop()
+                target = self.__temporary()
+                self.__emit(f"{target} = defer_power({operands.pop()}, {exponent})")
+                operands.append(target)
+            elif step == _MODULO:
+                modulus = operands.pop()
+                power = operands.pop()
+                target = self.__temporary()
+                self.__emit(f"{target} = {power}.modulo({modulus}) if {power}.__class__ is DeferredPower else {power} % {modulus}")
+                operands.append(target)
+            elif step == _SHARE:
+                self.__shared[node] = operands[-1]
+            elif step == _CHECK_CALL:
+                function = operands[-1]
+                count = len(node.arguments)
+                if function not in self.__known:
+                    self.__emit(f"if {function}.__class__ is not Function:")
+                    self.__emit(f"    raise ValueError('Not a function: ' + repr({function}))")
+                    self.__emit(f"if len({function}.parameters) != {count}:")
+                    self.__emit(f"    raise ValueError(f'{{{function}.name}}() takes {{len({function}.parameters)}} arguments, got {count}')")
+                elif self.__known[function].__class__ is not Function:
+                    self.__emit(f"raise ValueError('Not a function: ' + repr({function}))")
+                elif len(self.__known[function].parameters) != count:
+                    self.__emit(f"raise ValueError(f'{{{function}.name}}() takes {{len({function}.parameters)}} arguments, got {count}')")
+            elif step == _CALL:
+                count = len(node.arguments)
+                arguments = operands[len(operands) - count:]
+                del operands[len(operands) - count:]
+                target = self.__temporary()
+                self.__emit(f"{target} = call_function({operands.pop()}, [{', '.join(arguments)}])")
+                operands.append(target)
+            elif step == _IF:
+                # Temporaries assigned in one branch do not exist in the other or after the if
+                data = (self.__temporary(), dict(self.__variables), dict(self.__shared))
+                self.__emit(f"if {operands.pop()}:")
+                self.__indent += 1
+                pending.append((_END_IF, node, data))
+                pending.append((_VISIT, node.alternative, None))
+                pending.append((_ELSE, node, data))
+                pending.append((_VISIT, node.consequence, None))
+            else:
+                target, variables, shared = data
+                self.__emit(f"{target} = {operands.pop()}")
+                self.__variables, self.__shared = dict(variables), dict(shared)
+                self.__indent -= 1
+                if step == _ELSE:
+                    self.__emit("else:")
+                    self.__indent += 1
+                else:
+                    operands.append(target)
+        return operands.pop()
+
+
+def generate_source(program: Program) -> str:
+    """Returns the Python source that promote() compiles for `program`."""
+    return CodeGenerator().generate(program)
+
+
+def promote(program: Program) -> Optional[Callable]:
+    """Compiles `program` into a function of the current Budget, or returns None if it cannot."""
+    global promoted, rejected
+    generator = CodeGenerator()
+    try:
+        code = compile(generator.generate(program), "<haxian>", "exec")
+    except (_Unsupported, RecursionError, MemoryError, SyntaxError):
+        rejected += 1
+        return None
+    namespace = generator.namespace
+    exec(code, namespace)
+    promoted += 1
+    return namespace["evaluate"]
@@ -1,5 +1,6 @@
 # Token definitions for the Haxian math interpreter language
-from typing import Any
+from array import array
+from typing import Any, Iterator
 
 
 class TokenType:
@@ -22,9 +23,26 @@ class TokenType:
     LBRACE = "LBRACE"
     RBRACE = "RBRACE"
     SEMICOLON = "SEMICOLON"
+    EQ = "EQ"
+    LT = "LT"
+    GT = "GT"
+    # keywords
+    FN = "FN"
+    IF = "IF"
+    ELSE = "ELSE"
+
+
+# Identifiers that are lexed as keywords instead
+KEYWORDS = {
+    "fn": TokenType.FN,
+    "if": TokenType.IF,
+    "else": TokenType.ELSE,
+}
 
 
 class Token:
+      __slots__ = ("type", "literal", "line_no", "position")
+
       def __init__(self, type: TokenType, literal: Any, line_no : int ,position: int):
         self.type = type
         self.literal = literal
@@ -36,3 +54,68 @@ class Token:
 
       def __repr__(self):
         return str(self)
+
+
+# Small integer code for every token type, used by TokenBuffer
+TOKEN_TYPES = [value for name, value in vars(TokenType).items() if not name.startswith("_")]
+TOKEN_CODES = {tt: code for code, tt in enumerate(TOKEN_TYPES)}
+
+
+class TokenBuffer:
+      """
+      Columnar token storage: kinds are TOKEN_CODES in a byte array and
+      literals, line numbers and positions live in parallel columns, so no
+      Token object is kept per token.
+      """
+      def __init__(self):
+        self.kinds = array('B')
+        self.literals = []
+        self.line_nos = array('L')
+        self.positions = array('Q')
+
+      def __len__(self):
+        return len(self.kinds)
+
+      def append(self, type: TokenType, literal: Any, line_no: int, position: int):
+        self.kinds.append(TOKEN_CODES[type])
+        self.literals.append(literal)
+        self.line_nos.append(line_no)
+        self.positions.append(position)
+
+      def type(self, index: int) -> TokenType:
+        return TOKEN_TYPES[self.kinds[index]]
+
+      def token(self, index: int) -> Token:
+        return Token(TOKEN_TYPES[self.kinds[index]], self.literals[index], self.line_nos[index], self.positions[index])
+
+      def __iter__(self) -> Iterator[Token]:
+        return map(Token, map(TOKEN_TYPES.__getitem__, self.kinds), self.literals, self.line_nos, self.positions)
+
+
+class TokenCursor:
+      """
+      Reusable view of one entry of a TokenBuffer with the same attributes as
+      Token. seek() repoints it, so walking a buffer allocates nothing per token.
+      """
+      __slots__ = ("buffer", "index", "type", "literal", "line_no", "position")
+
+      def __init__(self, buffer: TokenBuffer, index: int = 0):
+        self.buffer = buffer
+        self.seek(index)
+
+      def seek(self, index: int):
+        buffer = self.buffer
+        # Reading past the end keeps returning the final (EOF) token
+        if index >= len(buffer.kinds):
+            index = len(buffer.kinds) - 1
+        self.index = index
+        self.type = TOKEN_TYPES[buffer.kinds[index]]
+        self.literal = buffer.literals[index]
+        self.line_no = buffer.line_nos[index]
+        self.position = buffer.positions[index]
+
+      def __str__(self):
+        return f"Token({self.type}, {self.literal}, line: {self.line_no}, pos: {self.position})"
+
+      def __repr__(self):
+        return str(self)
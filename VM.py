@@ -0,0 +1,173 @@
+import operator
+
+import AST
+from AST import DeferredPower, current_budget, defer_power
+from Compiler import Bytecode, OpCode
+from Environment import UNBOUND
+
+
+def _divide(left, right):
+    if right == 0:
+        raise ValueError("Division by zero")
+    return left / right
+
+
+def _square(left, right):
+    # Linked for ^ 2; floats still go to pow(), as x * x can round differently
+    if left.__class__ is int:
+        return left * left
+    return pow(left, right)
+
+
+def _modulo(left, right):
+    # Linked for a % whose left operand comes from a deferred power
+    if left.__class__ is DeferredPower:
+        return left.modulo(right)
+    return left % right
+
+def _less(left, right):
+    return 1 if left < right else 0
+
+
+def _greater(left, right):
+    return 1 if left > right else 0
+
+
+def _equal(left, right):
+    return 1 if left == right else 0
+
+
+def _assign(value, _):
+    return value
+
+
+def _bound(name: str):
+    # Linked before the first read of a variable the program does not assign first
+    def check(value, _):
+        if value is UNBOUND:
+            raise ValueError(f"Undefined variable: {name}")
+        return value
+    return check
+
+# Binary operator implementations indexed directly by opcode
+BINARY_OPERATIONS = [None] * (max(OpCode) + 1)
+BINARY_OPERATIONS[OpCode.ADD] = operator.add
+BINARY_OPERATIONS[OpCode.SUB] = operator.sub
+BINARY_OPERATIONS[OpCode.MUL] = operator.mul
+BINARY_OPERATIONS[OpCode.DIV] = _divide
+BINARY_OPERATIONS[OpCode.POW] = pow
+BINARY_OPERATIONS[OpCode.MOD] = operator.mod
+BINARY_OPERATIONS[OpCode.LT] = _less
+BINARY_OPERATIONS[OpCode.GT] = _greater
+BINARY_OPERATIONS[OpCode.EQ] = _equal
+
+# Operations whose results a Budget limits in size, by the operator it checks
+GROWING_OPERATIONS = {pow: '^', _square: '^', operator.mul: '*'}
+
+
+class VM:
+    """Stack VM that runs Bytecode linked into steps over a register file."""
+    def __init__(self, bytecode: Bytecode):
+        self.bytecode = bytecode
+        self.__link()
+
+    def __link(self):
+        constants = self.bytecode.constants
+        code = self.bytecode.code
+        args = self.bytecode.args
+        variables = {}
+        for opcode, arg in zip(code, args):
+            if (opcode == OpCode.LOAD_VAR or opcode == OpCode.STORE_VAR) and arg not in variables:
+                variables[arg] = len(constants) + len(variables)
+        names = self.bytecode.environment.names
+        assigned = set()
+        checked = set()
+
+        base = len(constants) + len(variables)
+        stack = []
+        depth = 0
+        instructions = []
+        # Index of the instruction that last wrote each stack register
+        producers = {}
+        result = None
+
+        for opcode, arg in zip(code, args):
+            if opcode == OpCode.LOAD_CONST:
+                stack.append(arg)
+            elif opcode == OpCode.LOAD_VAR:
+                register = variables[arg]
+                if arg not in assigned and arg not in checked:
+                    checked.add(arg)
+                    instructions.append((_bound(names[arg]), register, register, register))
+                stack.append(register)
+            elif opcode == OpCode.STORE_VAR:
+                register = variables[arg]
+                assigned.add(arg)
+                instructions.append((_assign, register, stack[-1], stack[-1]))
+            elif opcode == OpCode.POP:
+                stack.pop()
+            elif opcode == OpCode.RETURN:
+                result = stack.pop()
+                break
+            else:
+                operation = BINARY_OPERATIONS[opcode]
+                if operation is None:
+                    raise ValueError(f"Unknown opcode: {opcode}")
+                right = stack.pop()
+                left = stack.pop()
+                if opcode == OpCode.POW and right < len(constants) and constants[right].__class__ is int and constants[right] == 2:
+                    operation = _square
+                elif opcode == OpCode.MOD and left >= base and instructions[producers[left]][0] in (pow, _square):
+                    producer = producers[left]
+                    instructions[producer] = (defer_power,) + instructions[producer][1:]
+                    operation = _modulo
+                target = base + len(stack)
+                producers[target] = len(instructions)
+                instructions.append((operation, target, left, right))
+                stack.append(target)
+            depth = max(depth, len(stack))
+
+        if result is None:
+            raise ValueError("Bytecode ended without RETURN")
+
+        self.__instructions = instructions
+        self.__growing = [GROWING_OPERATIONS.get(instruction[0]) for instruction in instructions]
+        self.__registers = list(constants) + [None] * (len(variables) + depth)
+        self.__result = result
+        self.__values = self.bytecode.environment.values
+        self.__loads = list(variables.items())
+        self.__stores = [(slot, variables[slot]) for slot in assigned]
+
+    def run(self):
+        registers = self.__registers[:]
+        budget = current_budget() if AST.active_budgets else None
+        if self.__loads or budget is not None:
+            return self.__run_with_variables(registers, budget)
+        for operation, target, left, right in self.__instructions:
+            registers[target] = operation(registers[left], registers[right])
+        return registers[self.__result]
+
+    def __run_with_variables(self, registers: list, budget):
+        values = self.__values
+        for slot, register in self.__loads:
+            registers[register] = values[slot]
+        try:
+            if budget is None:
+                for operation, target, left, right in self.__instructions:
+                    registers[target] = operation(registers[left], registers[right])
+            else:
+                self.__run_budgeted(registers, budget)
+        finally:
+            # Assignments made before an error are kept, as when evaluating the AST
+            for slot, register in self.__stores:
+                values[slot] = registers[register]
+            if self.__stores:
+                self.bytecode.environment.version += 1
+        return registers[self.__result]
+
+    def __run_budgeted(self, registers: list, budget):
+        for (operation, target, left, right), growing in zip(self.__instructions, self.__growing):
+            budget.step()
+            if growing is not None:
+                budget.check(growing, registers[left], registers[right])
+            registers[target] = operation(registers[left], registers[right])
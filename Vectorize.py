@@ -0,0 +1,351 @@
+from typing import Dict
+
+from AST import *
+from Environment import UNBOUND
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Largest magnitude an int64 or a float64 represents exactly
+INT64_MAX = (1 << 63) - 1
+INT64_MIN = -(1 << 63)
+FLOAT_EXACT = 1 << 53
+
+# Products and powers whose estimated magnitude reaches this are computed
+# with Python ints instead of int64
+OVERFLOW_GUARD = 2.0 ** 62
+
+COMPARISONS = ('<', '>', '==')
+
+
+class VectorizedEvaluator:
+    """Evaluates a Program over whole NumPy columns at once, agreeing with Program.evaluate() row by row."""
+    def __init__(self, columns: Dict[str, object] = None, size: int = None):
+        if np is None:
+            raise ImportError("Vectorized evaluation requires numpy")
+        self.columns = {name: self.__as_array(values) for name, values in (columns or {}).items()}
+        sizes = {len(values) for values in self.columns.values()}
+        if size is not None:
+            sizes.add(size)
+        if len(sizes) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(sizes)}")
+        self.size = sizes.pop() if sizes else 1
+
+    def evaluate(self, program: Program, errors: str = "raise"):
+        """Returns one result per row; errors="mask" masks failing rows instead of raising."""
+        if errors not in ("raise", "mask"):
+            raise ValueError(f"Unknown errors mode: {errors}")
+        if not program.statements:
+            return None
+
+        # Values of SharedExpression nodes, computed once per evaluate(),
+        # and of the variables assigned so far, by slot
+        self.__shared = {}
+        self.__assigned = {}
+        self.__environment = program.environment
+        self.__budget = current_budget()
+        try:
+            with np.errstate(all="ignore"):
+                # A row whose assignment fails fails as a whole, as the
+                # scalar evaluator stops at the first error
+                assign_failed = np.zeros(self.size, dtype=bool)
+                for statement in program.statements[:-1]:
+                    if isinstance(statement, AssignStatement):
+                        assign_failed |= self.__evaluate_statement(statement)[1]
+                values, failed = self.__evaluate_statement(program.statements[-1])
+                failed = failed | assign_failed
+        finally:
+            self.__shared = {}
+            self.__assigned = {}
+            self.__environment = None
+            self.__budget = None
+
+        if errors == "mask":
+            return np.ma.masked_array(values, mask=failed)
+        if failed.any():
+            row = int(np.flatnonzero(failed)[0])
+            self.__replay(program, row)
+            raise ValueError(f"Evaluation failed in row {row}")
+        return values
+
+    def __replay(self, program: Program, row: int):
+        # Lets the scalar evaluator raise its own error for a failing row,
+        # with the row's values bound to the variables while it runs
+        environment = program.environment
+        names = [name for name in self.columns if name in environment.slots]
+        saved = environment.values[:]
+        environment.binder(names)([self.columns[name][row:row + 1].tolist()[0] for name in names])
+        try:
+            program.evaluate()
+        finally:
+            environment.values[:] = saved
+            environment.version += 1
+
+    def __as_array(self, values):
+        array = np.asarray(values)
+        if array.dtype.kind == 'b' or array.dtype.kind == 'i':
+            return array.astype(np.int64)
+        if array.dtype.kind == 'u':
+            if array.size and array.max() > INT64_MAX:
+                return self.__narrow(array.tolist())
+            return array.astype(np.int64)
+        if array.dtype.kind == 'f':
+            return array.astype(np.float64)
+        return self.__narrow(array.tolist())
+
+    def __narrow(self, items):
+        """
+        Packs Python numbers into int64 or float64 when all of them fit,
+        keeping an object array otherwise.
+        """
+        kinds = set(map(type, items))
+        if kinds <= {int}:
+            if not items or (min(items) >= INT64_MIN and max(items) <= INT64_MAX):
+                return np.array(items, dtype=np.int64)
+        elif kinds <= {float}:
+            return np.array(items, dtype=np.float64)
+        array = np.empty(len(items), dtype=object)
+        array[:] = items
+        return array
+
+    def __constant(self, value):
+        if type(value) is float:
+            return np.full(self.size, value, dtype=np.float64)
+        if INT64_MIN <= value <= INT64_MAX:
+            return np.full(self.size, value, dtype=np.int64)
+        array = np.empty(self.size, dtype=object)
+        array[:] = value
+        return array
+
+    def __evaluate_statement(self, statement: Statement):
+        if isinstance(statement, ExpressionStatement):
+            return self.__evaluate_expression(statement.expression)
+        if isinstance(statement, AssignStatement):
+            result = self.__assigned[statement.name.slot] = self.__evaluate_expression(statement.value)
+            return result
+        raise ValueError(f"Cannot vectorize statement: {statement.type()}")
+
+    def __evaluate_expression(self, expression: Expression):
+        if self.__budget is not None:
+            self.__budget.step(self.size)
+        if isinstance(expression, (IntegerLiteral, FloatLiteral)):
+            return self.__constant(expression.value), np.zeros(self.size, dtype=bool)
+        if isinstance(expression, Identifier):
+            return self.__variable(expression)
+        if isinstance(expression, SharedExpression):
+            result = self.__shared.get(expression)
+            if result is None:
+                result = self.__shared[expression] = self.__evaluate_expression(expression.expression)
+            return result
+        if isinstance(expression, InfixExpression):
+            power = expression.left
+            if expression.operator == '%' and power.__class__ is InfixExpression and power.operator == '^':
+                return self.__evaluate_power_mod(power, expression.right)
+            left, left_failed = self.__evaluate_expression(expression.left)
+            right, right_failed = self.__evaluate_expression(expression.right)
+            return self.__apply(expression.operator, left, right, left_failed | right_failed)
+        if isinstance(expression, IfExpression):
+            return self.__evaluate_if(expression)
+        raise ValueError(f"Cannot vectorize expression: {expression.type()}")
+
+    def __evaluate_power_mod(self, power: InfixExpression, modulus: Expression):
+        # a ^ b % m: when the power does not fit int64 arithmetic, each row
+        # uses pow(a, b, m) where it applies instead of building a ^ b
+        base, base_failed = self.__evaluate_expression(power.left)
+        exponent, exponent_failed = self.__evaluate_expression(power.right)
+        modulus, modulus_failed = self.__evaluate_expression(modulus)
+        failed = base_failed | exponent_failed
+        if base.dtype.kind == 'i' and exponent.dtype.kind == 'i':
+            values = self.__apply_int('^', base, exponent)
+            if values is not None:
+                return self.__apply('%', values, modulus, failed | modulus_failed)
+        elif 'O' not in base.dtype.kind + exponent.dtype.kind:
+            values, failed = self.__apply('^', base, exponent, failed)
+            return self.__apply('%', values, modulus, failed | modulus_failed)
+
+        failed = failed | modulus_failed
+        results = []
+        for row, (a, b, m, skip) in enumerate(zip(base.tolist(), exponent.tolist(), modulus.tolist(), failed.tolist())):
+            value = None
+            if not skip:
+                try:
+                    value = defer_power(a, b)
+                    if value.__class__ is DeferredPower:
+                        value = value.modulo(m)
+                    else:
+                        value = apply_infix('%', value, m)
+                except (ArithmeticError, TypeError, ValueError):
+                    failed[row] = True
+                    value = None
+            results.append(value)
+
+        filler = 0.0 if any(type(value) is float for value in results) else 0
+        return self.__narrow([filler if value is None else value for value in results]), failed
+
+    def __evaluate_if(self, expression: IfExpression):
+        # Each branch is only evaluated on the rows that take it, so a branch
+        # no row takes costs nothing and cannot fail
+        condition, failed = self.__evaluate_expression(expression.condition)
+        taken = condition != 0
+        branches = []
+        for rows, branch in ((np.flatnonzero(taken & ~failed), expression.consequence),
+                             (np.flatnonzero(~taken & ~failed), expression.alternative)):
+            if len(rows):
+                branches.append((rows,) + self.__evaluate_rows(branch, rows))
+        if not branches:
+            return self.__constant(0), failed
+
+        failed = failed.copy()
+        dtypes = {values.dtype for _, values, _ in branches}
+        if len(dtypes) == 1:
+            values = np.zeros(self.size, dtype=dtypes.pop())
+            for rows, branch_values, branch_failed in branches:
+                values[rows] = branch_values
+                failed[rows] = branch_failed
+            return values, failed
+        # Mixed ints and floats keep each row's own type, as they would in
+        # the scalar evaluator
+        items = [0] * self.size
+        for rows, branch_values, branch_failed in branches:
+            for row, value in zip(rows.tolist(), branch_values.tolist()):
+                items[row] = value
+            failed[rows] = branch_failed
+        return self.__narrow(items), failed
+
+    def __evaluate_rows(self, expression: Expression, rows):
+        """Evaluates `expression` on the given rows only, as if they were all the rows."""
+        if len(rows) == self.size:
+            return self.__evaluate_expression(expression)
+        saved = self.size, self.columns, self.__assigned, self.__shared
+        self.size = len(rows)
+        self.columns = {name: values[rows] for name, values in saved[1].items()}
+        self.__assigned = {slot: (values[rows], failed[rows]) for slot, (values, failed) in saved[2].items()}
+        self.__shared = {node: (values[rows], failed[rows]) for node, (values, failed) in saved[3].items()}
+        try:
+            return self.__evaluate_expression(expression)
+        finally:
+            self.size, self.columns, self.__assigned, self.__shared = saved
+
+    def __variable(self, identifier: Identifier):
+        result = self.__assigned.get(identifier.slot)
+        if result is not None:
+            return result
+        column = self.columns.get(identifier.name)
+        if column is not None:
+            return column, np.zeros(self.size, dtype=bool)
+        value = self.__environment.get(identifier.name, UNBOUND)
+        if value is UNBOUND:
+            raise ValueError(f"Undefined variable: {identifier.name}")
+        return self.__constant(value), np.zeros(self.size, dtype=bool)
+
+    def __apply(self, operator: str, left, right, failed):
+        kinds = left.dtype.kind + right.dtype.kind
+        if 'O' in kinds:
+            return self.__apply_exact(operator, left, right, failed)
+
+        if operator in ('/', '%'):
+            zero = right == 0
+            failed = failed | zero
+            right = np.where(zero, 1, right)
+
+        if kinds == 'ii':
+            values = self.__apply_int(operator, left, right)
+        elif operator in COMPARISONS and 'i' in kinds and self.__beyond_float(left if kinds[0] == 'i' else right):
+            # Python compares an int and a float exactly, float64 might not
+            values = None
+        else:
+            values = self.__apply_float(operator, left.astype(np.float64), right.astype(np.float64))
+
+        if values is None:
+            return self.__apply_exact(operator, left, right, failed)
+        return values, failed
+
+    @staticmethod
+    def __apply_int(operator: str, left, right):
+        if operator == '+':
+            values = left + right
+            if (((left ^ values) & (right ^ values)) < 0).any():
+                return None
+            return values
+        if operator == '-':
+            values = left - right
+            if (((left ^ right) & (left ^ values)) < 0).any():
+                return None
+            return values
+        if operator == '*':
+            if (np.abs(left.astype(np.float64) * right) >= OVERFLOW_GUARD).any():
+                return None
+            return left * right
+        if operator == '/':
+            if (np.abs(left) > FLOAT_EXACT).any() or (np.abs(right) > FLOAT_EXACT).any():
+                return None
+            return left.astype(np.float64) / right
+        if operator == '%':
+            return np.remainder(left, right)
+        if operator == '^':
+            if (right < 0).any():
+                return None
+            magnitude = np.log2(np.abs(left.astype(np.float64)) + 1) * right
+            if (magnitude >= 62).any():
+                return None
+            return np.power(left, right)
+        if operator in COMPARISONS:
+            return VectorizedEvaluator.__compare(operator, left, right)
+        raise ValueError(f"Unknown operator: {operator}")
+
+    @staticmethod
+    def __apply_float(operator: str, left, right):
+        if operator == '+':
+            return left + right
+        if operator == '-':
+            return left - right
+        if operator == '*':
+            return left * right
+        if operator == '/':
+            return left / right
+        if operator == '%':
+            return np.remainder(left, right)
+        if operator == '^':
+            # NumPy's float power is not always correctly rounded the same
+            # way as the C library pow() Python uses
+            return None
+        if operator in COMPARISONS:
+            return VectorizedEvaluator.__compare(operator, left, right)
+        raise ValueError(f"Unknown operator: {operator}")
+
+    @staticmethod
+    def __compare(operator: str, left, right):
+        if operator == '<':
+            values = left < right
+        elif operator == '>':
+            values = left > right
+        else:
+            values = left == right
+        return values.astype(np.int64)
+
+    @staticmethod
+    def __beyond_float(values) -> bool:
+        return bool(((values > FLOAT_EXACT) | (values < -FLOAT_EXACT)).any())
+
+    def __apply_exact(self, operator: str, left, right, failed):
+        failed = failed.copy()
+        results = []
+        for row, (a, b, skip) in enumerate(zip(left.tolist(), right.tolist(), failed.tolist())):
+            value = None
+            if not skip:
+                try:
+                    value = apply_infix(operator, a, b)
+                except (ArithmeticError, TypeError, ValueError):
+                    failed[row] = True
+            results.append(value)
+
+        # Failed rows get a filler of the same type as the other results so
+        # they do not force an object array
+        filler = 0.0 if any(type(value) is float for value in results) else 0
+        return self.__narrow([filler if value is None else value for value in results]), failed
+
+
+def evaluate_vectorized(program: Program, columns: Dict[str, object] = None, size: int = None, errors: str = "raise"):
+    return VectorizedEvaluator(columns, size).evaluate(program, errors)
@@ -0,0 +1,374 @@
+import os
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
+
+from AST import (AssignStatement, CallExpression, ExpressionStatement, Function, FunctionStatement, Identifier,
+                 IfExpression, InfixExpression, SharedExpression, Statement)
+from Budget import Budget
+from Environment import UNBOUND, Environment
+from Instrumentation import metrics
+from Lexer import create_lexer
+from Parser import Parser
+
+# Seconds between two looks at the watched file
+DEFAULT_INTERVAL = 0.1
+
+# Characters compared at a time when looking for the part of a script that changed
+COMPARE_BLOCK = 256
+
+# A statement starts after every ; and, in a script that parses, at every
+# line that starts with an assignment or a function definition, as neither
+# can continue the statement before it. Segments split there parse on their
+# own exactly as they do within the whole script.
+SEGMENT_END = re.compile(r";|\n(?=[ \t]*(?:fn\b|(?!(?:if|else)\b)[^\W\d]\w*[ \t]*=(?!=)))")
+
+
+def common_prefix(old: str, new: str) -> int:
+    length = min(len(old), len(new))
+    start = 0
+    # Whole blocks first, as comparing slices runs at C speed
+    while start + COMPARE_BLOCK <= length and old[start:start + COMPARE_BLOCK] == new[start:start + COMPARE_BLOCK]:
+        start += COMPARE_BLOCK
+    while start < length and old[start] == new[start]:
+        start += 1
+    return start
+
+
+def common_suffix(old: str, new: str, limit: int) -> int:
+    """Length of the common end of `old` and `new`, at most `limit`."""
+    length = 0
+    while length + COMPARE_BLOCK <= limit and \
+            old[len(old) - length - COMPARE_BLOCK:len(old) - length] == new[len(new) - length - COMPARE_BLOCK:len(new) - length]:
+        length += COMPARE_BLOCK
+    while length < limit and old[len(old) - length - 1] == new[len(new) - length - 1]:
+        length += 1
+    return length
+
+
+def read_names(node) -> frozenset:
+    """Names of the variables an expression or statement reads."""
+    names = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        cls = node.__class__
+        if cls is Identifier:
+            names.add(node.name)
+        elif cls is InfixExpression:
+            pending.append(node.right)
+            pending.append(node.left)
+        elif cls is CallExpression:
+            pending.append(node.function)
+            pending.extend(node.arguments)
+        elif cls is IfExpression:
+            pending.extend((node.condition, node.consequence, node.alternative))
+        elif cls is SharedExpression or isinstance(node, ExpressionStatement):
+            pending.append(node.expression)
+        elif cls is AssignStatement:
+            pending.append(node.value)
+    return frozenset(names)
+
+
+def first_line(statement: Statement) -> int:
+    """Line of the leftmost token of a statement, counted within its segment."""
+    if statement.__class__ is AssignStatement or statement.__class__ is FunctionStatement:
+        return statement.name.line_no
+    node = statement.expression
+    while True:
+        cls = node.__class__
+        if cls is InfixExpression:
+            node = node.left
+        elif cls is CallExpression:
+            node = node.function
+        elif cls is IfExpression:
+            node = node.condition
+        elif cls is SharedExpression:
+            node = node.expression
+        else:
+            return getattr(node, "line_no", 1)
+
+
+def same_value(old, new) -> bool:
+    if old.__class__ is not new.__class__:
+        return False
+    if old.__class__ is float:
+        # Also tells -0.0 from 0.0
+        return old.hex() == new.hex()
+    if old.__class__ is int or old.__class__ is complex:
+        return old == new
+    return old is new
+
+
+class Segment:
+    """The statements parsed from one segment of a script, and what each reads."""
+    __slots__ = ("text", "statements", "errors", "reads", "functions")
+
+    def __init__(self, text: str, environment: Environment):
+        self.text = text
+        parser = Parser(create_lexer(text), environment)
+        with metrics.phase("parse"):
+            self.statements = list(parser.parse_statements())
+        self.errors = parser.errors
+        self.reads = []
+        self.functions = {}
+        for statement in self.statements:
+            metrics.count_nodes(statement, "nodes_built")
+            if statement.__class__ is FunctionStatement:
+                # Defining a function reads nothing; its callers read what its body does
+                self.reads.append(frozenset())
+                self.functions[statement.function] = read_names(statement.function.body)
+            else:
+                self.reads.append(read_names(statement))
+
+
+class Result:
+    """
+    Outcome of a statement's last evaluation. `key` pairs every name the
+    statement read with the token of the definition it saw; `token` stands
+    for the value the statement assigned.
+    """
+    __slots__ = ("key", "value", "error", "token")
+
+    def __init__(self, key: frozenset, value, error: Optional[str], token: object):
+        self.key = key
+        self.value = value
+        self.error = error
+        self.token = token
+
+
+
+class Watcher:
+    """Re-runs a script as it changes, evaluating only statements whose definitions changed."""
+    def __init__(self, filename: str, environment: Environment = None, budget: Budget = None, output=None):
+        self.filename = filename
+        self.environment = environment if environment is not None else Environment()
+        self.budget = budget
+        self.output = output if output is not None else sys.stdout
+        self.text = None
+        # Segments of the script, with the offset and line each starts at
+        self.segments = []
+        self.starts = []
+        self.lines = []
+        self.statements = 0
+        self.results = {}
+        self.functions = {}
+        # Segments that ran to the end in the last run
+        self.completed = 0
+        # Token of the current definition and number of assignments of each name
+        self.definitions = {}
+        self.counts = {}
+        # (name, n) -> (value, token) of the n-th assignment of a name
+        self.assignments = {}
+        # (segment index, slot, value, name, definition, count) from before each assignment
+        self.log = []
+
+    def update(self, text: str) -> bool:
+        """Runs the script again with `text` as its contents; returns whether it succeeded."""
+        started = time.perf_counter()
+        if self.text is None:
+            self.environment.reset()
+        first, parsed = self.__split(text)
+        first = min(first, self.completed)
+        self.__rewind(first)
+
+        environment = self.environment
+        values = environment.values
+        definitions = self.definitions
+        counts = self.counts
+        assignments = self.assignments
+        results = self.results
+        functions = self.functions
+        log = self.log
+        lines = []
+        evaluated = 0
+        succeeded = True
+        index = first
+        for index in range(first, len(self.segments)):
+            segment = self.segments[index]
+            if segment.errors:
+                line = self.lines[index] + segment.text[:len(segment.text) - len(segment.text.lstrip())].count("\n")
+                lines.extend(f"Error: line {line}: {error}" for error in segment.errors)
+                succeeded = False
+                break
+            for statement, reads in zip(segment.statements, segment.reads):
+                if statement.side_effects:
+                    # Evaluating an assignment already stores its value
+                    previous = values[statement.name.slot]
+                key = self.__key(reads, definitions, functions) if reads else reads
+                result = results.get(statement)
+                if result is None or result.key != key:
+                    result = results[statement] = self.__evaluate(statement, key)
+                    evaluated += 1
+                    lines.append(self.__report(index, statement, result))
+                elif result.error is not None:
+                    lines.append(self.__report(index, statement, result))
+                if result.error is not None:
+                    succeeded = False
+                    break
+                if statement.side_effects:
+                    name = statement.name
+                    count = counts.get(name.name, 0)
+                    log.append((index, name.slot, previous, name.name, definitions.get(name.name), count))
+                    values[name.slot] = result.value
+                    environment.version += 1
+                    # The same assignment as last time, by name and count,
+                    # keeps its token if it assigned the same value
+                    assignment = (name.name, count)
+                    if result.token is None:
+                        value, token = assignments.get(assignment, (UNBOUND, None))
+                        result.token = token if token is not None and same_value(value, result.value) else object()
+                    assignments[assignment] = (result.value, result.token)
+                    definitions[name.name] = result.token
+                    counts[name.name] = count + 1
+            if not succeeded:
+                break
+        self.completed = index if not succeeded else len(self.segments)
+        if succeeded and len(assignments) > 2 * self.statements + 64:
+            self.__prune()
+
+        lines.append(f"-- evaluated {evaluated} of {self.statements} statements, parsed {parsed} of {len(self.segments)} segments "
+                     f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+        self.output.write("\n".join(lines) + "\n")
+        self.output.flush()
+        return succeeded
+
+    def watch(self, interval: float = DEFAULT_INTERVAL):
+        """Runs the script, then again whenever it changes, until interrupted."""
+        signature = None
+        missing = False
+        while True:
+            try:
+                stat = os.stat(self.filename)
+                missing = False
+                if (stat.st_mtime_ns, stat.st_size) != signature:
+                    signature = (stat.st_mtime_ns, stat.st_size)
+                    with open(self.filename, "r") as file:
+                        text = file.read()
+                    if text != self.text:
+                        self.update(text)
+            except OSError as e:
+                # e.g. an editor replacing the file; reported once until it is back
+                if not missing:
+                    print(f"Error: {e}", file=self.output, flush=True)
+                missing = True
+                signature = None
+            time.sleep(interval)
+
+    def __split(self, text: str) -> Tuple[int, int]:
+        """Re-splits `text` from its first change; returns the first segment split and how many were parsed."""
+        old = self.text if self.text is not None else ""
+        self.text = text
+        prefix = common_prefix(old, text)
+        suffix = common_suffix(old, text, min(len(old), len(text)) - prefix)
+        starts = self.starts
+        # Whether a boundary is there depends on the line after it, so the
+        # segment before the one that changed is split again too
+        first = max(0, bisect_right(starts, prefix) - 2)
+        position = starts[first] if first < len(starts) else 0
+        line = self.lines[first] if first < len(starts) else 1
+        shift = len(text) - len(old)
+        unchanged = len(text) - suffix
+
+        pieces = []
+        rest = len(starts)
+        for match in SEGMENT_END.finditer(text, position):
+            end = match.end()
+            pieces.append((position, line, text[position:end]))
+            line += pieces[-1][2].count("\n")
+            position = end
+            if match.start() >= unchanged:
+                # From an old boundary on, the rest splits as it did before
+                index = bisect_left(starts, end - shift)
+                if index < len(starts) and starts[index] == end - shift:
+                    rest = index
+                    break
+        else:
+            if position < len(text):
+                pieces.append((position, line, text[position:]))
+
+        # Segments that were replaced are still reused by their text, e.g. moved ones
+        replaced = {}
+        for segment in self.segments[first:rest]:
+            replaced.setdefault(segment.text, []).append(segment)
+        segments = []
+        parsed = 0
+        for _, _, piece in pieces:
+            reusable = replaced.get(piece)
+            if reusable:
+                segments.append(reusable.pop())
+                continue
+            segment = Segment(piece, self.environment)
+            segments.append(segment)
+            parsed += 1
+            self.statements += len(segment.statements)
+            self.functions.update(segment.functions)
+        for unused in replaced.values():
+            for segment in unused:
+                self.statements -= len(segment.statements)
+                for statement in segment.statements:
+                    self.results.pop(statement, None)
+                for function in segment.functions:
+                    del self.functions[function]
+
+        lines = self.lines
+        line_shift = line - lines[rest] if rest < len(lines) else 0
+        self.starts = starts[:first] + [start for start, _, _ in pieces] + [start + shift for start in starts[rest:]]
+        self.lines = lines[:first] + [line for _, line, _ in pieces] + [line + line_shift for line in lines[rest:]]
+        self.segments = self.segments[:first] + segments + self.segments[rest:]
+        return first, parsed
+
+    def __rewind(self, first: int):
+        """Undoes the assignments made by segment `first` and the ones after it."""
+        log = self.log
+        values = self.environment.values
+        while log and log[-1][0] >= first:
+            _, slot, value, name, definition, count = log.pop()
+            values[slot] = value
+            if definition is None:
+                del self.definitions[name]
+            else:
+                self.definitions[name] = definition
+            if count:
+                self.counts[name] = count
+            else:
+                del self.counts[name]
+        self.environment.version += 1
+
+    def __prune(self):
+        # Drops the assignments that are not in the script any more
+        counts = self.counts
+        self.assignments = {(name, count): definition for (name, count), definition in self.assignments.items()
+                            if count < counts.get(name, 0)}
+
+    def __key(self, reads: frozenset, definitions: Dict[str, object], functions: Dict[Function, frozenset]) -> frozenset:
+        names = set(reads)
+        pending = list(reads)
+        environment = self.environment
+        # Names the functions it can reach read when called
+        while pending:
+            value = environment.get(pending.pop(), UNBOUND)
+            if value.__class__ is Function:
+                for name in functions.get(value, ()):
+                    if name not in names:
+                        names.add(name)
+                        pending.append(name)
+        return frozenset((name, definitions.get(name)) for name in names)
+
+    def __report(self, index: int, statement: Statement, result: Result) -> str:
+        line = self.lines[index] + first_line(statement) - 1
+        if result.error is not None:
+            return f"[{line}] Error: {result.error}"
+        return f"[{line}] {result.value}"
+
+    def __evaluate(self, statement: Statement, key: frozenset) -> Result:
+        try:
+            with metrics.phase("evaluate"), self.budget if self.budget is not None else nullcontext():
+                value = statement.evaluate()
+        except Exception as e:
+            return Result(key, None, str(e), None)
+        metrics.count_nodes(statement, "nodes_visited_static")
+        return Result(key, value, None, None)
@@ -1,48 +1,259 @@
-from Lexer import Lexer, TokenType
+import argparse
+import json
+import os
+import sys
+from contextlib import nullcontext
+
+from Budget import add_budget_arguments, budget_from_args
+from Cache import ProgramCache
+from Instrumentation import InstrumentedLexer, metrics
+from Lexer import create_lexer
 from Parser import Parser
-from Token import Token
-from AST import*
 
-def main():
+# Parsed programs and results of interactive input, reused across lines.
+# Its environment holds the variables of the session, scripts included
+cache = ProgramCache()
+
+# Limits every evaluation is run under, if given on the command line
+budget = None
+
+# Output lines collected by run_pipe() before they are written in one go
+OUTPUT_CHUNK_LINES = 4096
+
+def budgeted():
+    return budget if budget is not None else nullcontext()
+
+def report_errors(errors):
+    for error in errors:
+        print(f"Error: {error}")
+
+def run(lexer, writer=None) -> bool:
+    """
+    Parses and evaluates statements one at a time, printing each result as
+    soon as its statement has been parsed. Stops at the first error. Parsed
+    statements are also handed to `writer` if one is given.
+    """
+    parser = Parser(InstrumentedLexer(lexer, metrics) if metrics.enabled else lexer, cache.environment)
+    statements = parser.parse_statements()
+    try:
+        while True:
+            with metrics.phase("parse"):
+                statement = next(statements, None)
+            if statement is None or parser.errors:
+                break
+            metrics.count_nodes(statement, "nodes_built")
+            if writer is not None:
+                writer.write(statement)
+            with metrics.phase("evaluate"), budgeted():
+                value = statement.evaluate()
+            metrics.count_nodes(statement, "nodes_visited_static")
+            print(value)
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
+    if parser.errors:
+        report_errors(parser.errors)
+        return False
+    return True
+
+def run_cached(source: str) -> bool:
+    """
+    Like run(), but a line that was entered before skips lexing, parsing
+    and evaluation and prints the remembered results.
+    """
+    try:
+        entry = cache.get(source)
+        if entry.errors:
+            report_errors(entry.errors)
+            return False
+        with budgeted():
+            for value in cache.results(entry):
+                print(value)
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+    return True
+
+def plain_line(number: int, value=None, error: str = None) -> str:
+    return str(value) if error is None else f"Error: {error}"
+
+def json_line(number: int, value=None, error: str = None) -> str:
+    if error is not None:
+        return json.dumps({"line": number, "error": error})
+    if type(value) is int:
+        # Already valid JSON as it is, and far cheaper than dumps()
+        return f'{{"line": {number}, "value": {value}}}'
+    # Anything JSON has no number for, e.g. a complex power or a function
+    if value is not None and type(value) is not float:
+        value = str(value)
+    return json.dumps({"line": number, "value": value})
+
+LINE_FORMATS = {"plain": plain_line, "json": json_line}
+
+def run_pipe(lines, output=None, line_format=plain_line, fail_fast: bool = False) -> bool:
+    """Evaluates `lines` without prompts, writing a line per result; returns whether all succeeded."""
+    if output is None:
+        output = sys.stdout
+    pending = []
+    succeeded = True
+    for number, line in enumerate(lines, 1):
+        source = line.strip()
+        if not source:
+            continue
+        try:
+            entry = cache.get(source)
+            if entry.errors:
+                raise ValueError("; ".join(entry.errors))
+            with budgeted():
+                for value in cache.results(entry):
+                    pending.append(line_format(number, value))
+        except Exception as e:
+            succeeded = False
+            pending.append(line_format(number, error=str(e)))
+            if fail_fast:
+                break
+        if len(pending) >= OUTPUT_CHUNK_LINES:
+            output.write("\n".join(pending) + "\n")
+            pending.clear()
+    if pending:
+        output.write("\n".join(pending) + "\n")
+    output.flush()
+    return succeeded
+
+def run_statements(statements) -> bool:
+    try:
+        for statement in statements:
+            with metrics.phase("evaluate"), budgeted():
+                value = statement.evaluate()
+            metrics.count_nodes(statement, "nodes_visited_static")
+            print(value)
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+    return True
+
+def run_file(filename: str) -> bool:
+    """
+    Runs a script, skipping lexing and parsing when __haxcache__ holds its
+    statements for the current contents. Otherwise the script is parsed and
+    the cache is rewritten once every statement has run successfully.
+    """
+    # Only scripts need the cache, so the prompt and pipe mode start without it
+    from DiskCache import CacheWriter, HashingReader, load, source_hash
+
+    # The digest and the statements come from the same open file, so the
+    # cache is never written for contents other than the ones parsed
+    try:
+        file = open(filename, "rb")
+    except OSError as e:
+        print(f"Error: {e}")
+        return False
+
+    with file:
+        try:
+            digest = source_hash(file)
+        except OSError as e:
+            print(f"Error: {e}")
+            return False
+
+        with metrics.phase("load_cache"):
+            statements = load(filename, digest, cache.environment)
+        if statements is not None:
+            return run_statements(statements)
+
+        # The lexer reads the file in chunks as the statements are run, and
+        # the chunks are hashed again in case the file changed in place
+        reader = HashingReader(file)
+        writer = CacheWriter.create(filename, digest)
+        succeeded = False
+        try:
+            succeeded = run(create_lexer(reader), writer)
+        finally:
+            if writer is not None:
+                writer.close(commit=succeeded and reader.digest.digest() == digest)
+        return succeeded
+
+def watch_file(filename: str, interval: float = None):
+    """Runs a script and runs it again each time it is saved, until interrupted."""
+    # Only watch mode needs the watcher, as with the disk cache
+    from Watch import DEFAULT_INTERVAL, Watcher
+
+    try:
+        Watcher(filename, budget=budget).watch(interval if interval is not None else DEFAULT_INTERVAL)
+    except KeyboardInterrupt:
+        print()
+
+def show_stats(argument: str):
+    if argument == "on":
+        metrics.enable()
+    elif argument == "off":
+        metrics.disable()
+    elif argument == "reset":
+        metrics.reset()
+    elif argument:
+        print(f"Error: Unknown :stats argument: {argument}")
+    else:
+        # Only :stats needs the tiering counters, so starting up does not load the code generator
+        import Tiering
+
+        print(metrics.format())
+        print("cache            " + ", ".join(f"{name} {value}" for name, value in cache.stats().items()))
+        print("tiering          " + ", ".join(f"{name} {value}" for name, value in Tiering.stats().items()))
+
+def repl():
     while True:
         user_input = input("Haxian> ")
-        if user_input.strip().lower() in ("exit", "quit"):
+        command = user_input.strip()
+        if command.lower() in ("exit", "quit"):
             print("Exiting interpreter.")
             break
-        if user_input.strip().endswith('.hax'):
-            filename = user_input.strip()
-            try:
-                with open(filename, "r") as file:
-                    source = file.read()
-                debug = Lexer(source)
-                while True:
-                    token = debug.next_token()
-                    if token is None:
-                        print('Lexer returned None')
-                        break
-                    print(token)
-                    if token.type == TokenType.EOF:
-                        break
-            except Exception as e:
-                print(f"Error: {e}")
+        if command == ":stats" or command.startswith(":stats "):
+            show_stats(command[len(":stats"):].strip())
+        elif command.endswith('.hax'):
+            run_file(command)
         else:
-            try:
-                lexer = Lexer(user_input)
-                tokens = lexer.tokenize()
+            run_cached(user_input)
 
-                if tokens and tokens[0].type != TokenType.EOF:
-                    result = evaluate_arithmetic(tokens)
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Interactive Haxian interpreter, a filter with -c and --pipe, or a script runner with --watch.")
+    arg_parser.add_argument("-c", dest="commands", metavar="EXPRESSION", action="append", help="evaluate this expression and exit; can be repeated")
+    arg_parser.add_argument("--pipe", action="store_true", help="evaluate each line of stdin, without prompts, and exit")
+    arg_parser.add_argument("--format", choices=sorted(LINE_FORMATS), default="plain", help="output of -c and --pipe: values as the prompt prints them, or JSON lines")
+    arg_parser.add_argument("--fail-fast", action="store_true", help="with -c or --pipe, stop at the first error")
+    arg_parser.add_argument("--watch", metavar="FILE", help="run FILE, then re-run the statements that change each time it is saved")
+    arg_parser.add_argument("--interval", type=float, metavar="SECONDS", help="with --watch, how often to look at FILE (default: 0.1)")
+    arg_parser.add_argument("--stats", action="store_true", help="collect timings and counters, shown with :stats")
+    arg_parser.add_argument("--trace-memory", action="store_true", help="also track peak memory per phase with tracemalloc")
+    arg_parser.add_argument("--stats-json", metavar="PATH", help="collect metrics and write them as JSON to PATH on exit")
+    add_budget_arguments(arg_parser)
+    args = arg_parser.parse_args(argv)
 
-                    parser_lexer = Lexer(user_input)
-                    parser = Parser(parser_lexer)
+    global budget
+    budget = budget_from_args(args)
 
-                    if not parser.errors:
-                        print(result)
-                    else:
-                        print(f"Result: {result} (with parser errors)")
-            except Exception as e:
-                print(f"Error: {e}")
+    if args.stats or args.trace_memory or args.stats_json:
+        metrics.enable(trace_memory=args.trace_memory)
+    try:
+        if args.watch:
+            watch_file(args.watch, args.interval)
+            return 0
+        if args.commands or args.pipe:
+            lines = args.commands if args.commands else sys.stdin
+            try:
+                return 0 if run_pipe(lines, sys.stdout, LINE_FORMATS[args.format], args.fail_fast) else 1
+            except BrokenPipeError:
+                # The reader went away, e.g. `| head`; stdout is pointed at
+                # devnull so flushing it on exit does not fail again
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                return 1
+        repl()
+    except EOFError:
+        print()
+    finally:
+        if args.stats_json:
+            metrics.dump_json(args.stats_json)
+    return 0
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import pytest
+
+from Budget import Budget, BudgetExceeded, StepLimitExceeded
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+
+FIBONACCI = "fn f(n) = if (n < 2) n else f(n - 1) + f(n - 2); f(200)"
+
+
+def parse(source):
+    return Parser(Lexer(source), Environment()).parse_program()
+
+
+def test_budget_does_not_limit_recursion_depth():
+    expected = parse(FIBONACCI).evaluate()
+    with Budget(max_steps=10 ** 7, timeout=60):
+        assert parse(FIBONACCI).evaluate() == expected
+
+
+def test_steps_are_still_counted():
+    with pytest.raises(StepLimitExceeded):
+        with Budget(max_steps=100):
+            parse(FIBONACCI).evaluate()
+
+
+def test_timeout_alone_stops_a_huge_power():
+    program = parse("9 ^ 99999999")
+    with pytest.raises(BudgetExceeded):
+        with Budget(timeout=0.5):
+            program.evaluate()
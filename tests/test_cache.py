@@ -0,0 +1,35 @@
+from Cache import ProgramCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ProgramCache(max_entries=2)
+    cache.evaluate("1 + 1")
+    cache.evaluate("2 + 2")
+    assert cache.evaluate("1  +  1") == 2
+    cache.evaluate("3 + 3")
+    assert "1 + 1" in cache and "1  +  1" in cache and "3 + 3" in cache
+    assert "2 + 2" not in cache
+    assert len(cache) == 2 and cache.evictions == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 3
+
+
+def test_byte_limit_evicts_oldest_entries():
+    cache = ProgramCache()
+    cache.get("x = 1; x * 2 + 3")
+    size = cache.size
+    cache = ProgramCache(max_bytes=2 * size)
+    for value in range(5):
+        cache.get(f"x = {value}; x * 2 + 3")
+        assert cache.size <= cache.max_bytes
+        assert cache.size == sum(entry.size for entry in cache.entries.values())
+    assert len(cache) == 2 and cache.evictions == 3
+    assert "x = 4; x * 2 + 3" in cache and "x = 2; x * 2 + 3" not in cache
+
+
+def test_remembered_results_count_towards_the_byte_limit():
+    cache = ProgramCache()
+    entry = cache.get("2 ^ 100; 3 ^ 100")
+    size = cache.size
+    assert list(cache.results(entry)) == [2 ** 100, 3 ** 100]
+    assert entry.results is not None and cache.size > size
+    assert cache.size == entry.size
@@ -0,0 +1,29 @@
+import pytest
+
+from Compiler import Compiler
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+from VM import VM
+
+
+def outcome(run):
+    try:
+        return "value", run()
+    except ValueError as e:
+        return "error", str(e)
+
+
+@pytest.mark.parametrize("source", [
+    "1 / 0; 5",
+    "x = 2; 1 / 0; x * 3",
+    "x = 1 / 0; 5",
+    "1 / 0",
+    "2; 3; 4",
+    "x = 4; x / 2; x = x + 1; x",
+])
+def test_vm_agrees_with_tree_evaluator(source):
+    program = Parser(Lexer(source), Environment()).parse_program()
+    expected = outcome(program.evaluate)
+    program.environment.reset()
+    assert outcome(VM(Compiler().compile(program)).run) == expected
@@ -0,0 +1,66 @@
+import os
+
+import DiskCache
+from DiskCache import CacheWriter, cache_path, source_hash
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+
+SOURCE = "fn f(a) = a * 2.5; x = 1; y = f(x) + 1.0; y % 2"
+
+
+def write_cache(tmp_path, source=SOURCE):
+    filename = str(tmp_path / "script.hx")
+    with open(filename, "w") as file:
+        file.write(source)
+    with open(filename, "rb") as file:
+        digest = source_hash(file)
+    program = Parser(Lexer(source), Environment()).parse_program()
+    writer = CacheWriter.create(filename, digest)
+    for statement in program.statements:
+        writer.write(statement)
+    writer.close(commit=True)
+    return filename, digest
+
+
+def evaluate(statements, environment):
+    value = None
+    for statement in statements:
+        value = statement.evaluate()
+    return value, repr(environment.values)
+
+
+def test_hit_decodes_the_same_statements(tmp_path):
+    filename, digest = write_cache(tmp_path)
+    environment = Environment()
+    statements = DiskCache.load(filename, digest, environment)
+    expected = Environment()
+    program = Parser(Lexer(SOURCE), expected).parse_program()
+    assert len(statements) == len(program.statements)
+    assert evaluate(statements, environment) == evaluate(program.statements, expected)
+
+
+def test_other_contents_miss(tmp_path):
+    filename, _ = write_cache(tmp_path)
+    with open(filename, "w") as file:
+        file.write(SOURCE + " + 1")
+    with open(filename, "rb") as file:
+        assert DiskCache.load(filename, source_hash(file)) is None
+
+
+def test_truncated_file_misses(tmp_path):
+    filename, digest = write_cache(tmp_path)
+    with open(cache_path(filename), "rb") as file:
+        data = file.read()
+    for length in range(len(data)):
+        with open(cache_path(filename), "wb") as file:
+            file.write(data[:length])
+        assert DiskCache.load(filename, digest) is None
+
+
+def test_uncommitted_writer_leaves_no_cache(tmp_path):
+    filename = str(tmp_path / "script.hx")
+    writer = CacheWriter.create(filename, b"\0" * 32)
+    writer.close(commit=False)
+    assert os.listdir(os.path.dirname(cache_path(filename))) == []
+    assert DiskCache.load(filename, b"\0" * 32) is None
@@ -0,0 +1,31 @@
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+
+
+def run(source, environment):
+    return Parser(Lexer(source), environment).parse_program().evaluate()
+
+
+def test_memo_is_dropped_when_a_variable_is_rebound():
+    environment = Environment()
+    assert run("k = 2; fn f(a) = a * k; f(3)", environment) == 6
+    function = environment.get("f")
+    assert function.memo
+    assert run("f(3)", environment) == 6
+    assert run("k = 5; f(3)", environment) == 15
+    environment.bind(k=7)
+    assert run("f(3)", environment) == 21
+
+
+def test_memo_tells_equal_arguments_of_other_types_apart():
+    environment = Environment()
+    assert run("fn f(a) = a * 3; f(1)", environment) == 3
+    result = run("f(1.0)", environment)
+    assert result == 3 and type(result) is float
+    assert type(run("f(1)", environment)) is int
+
+
+def test_tail_recursion_needs_no_stack():
+    environment = Environment()
+    assert run("fn s(n, t) = if (n < 1) t else s(n - 1, t + n); s(100000, 0)", environment) == 5000050000
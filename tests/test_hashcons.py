@@ -0,0 +1,46 @@
+from AST import InfixExpression, SharedExpression, SharedStatement
+from Environment import Environment
+from HashCons import Interner
+from Lexer import Lexer
+from Parser import Parser
+
+
+def parse(source, **values):
+    environment = Environment()
+    environment.bind(**values)
+    return Parser(Lexer(source), environment).parse_program()
+
+
+def test_repeated_subtrees_become_one_node():
+    program = parse("(x * y + 1) * (x * y + 1) - (x * y)", x=3, y=4)
+    interner = Interner()
+    interned = interner.intern(program)
+    statement = interned.statements[0]
+    assert isinstance(statement, SharedStatement)
+    product = statement.expression.left
+    assert isinstance(product.left, SharedExpression)
+    assert product.left is product.right
+    assert product.left.expression.left is statement.expression.right
+    assert interner.tree_nodes == 15 and interner.dag_nodes == 7
+    assert interned.evaluate() == program.evaluate() == 157
+
+
+def test_shared_subexpression_is_evaluated_once(monkeypatch):
+    program = Interner().intern(parse("(x * y + 1) * (x * y + 1)", x=3, y=4))
+    shared = program.statements[0].expression.left.expression
+    calls = []
+    evaluate = InfixExpression.evaluate
+    monkeypatch.setattr(InfixExpression, "evaluate",
+                        lambda node: calls.append(node) or evaluate(node))
+    assert program.evaluate() == 169
+    assert calls.count(shared) == 1
+    calls.clear()
+    # Each evaluation starts from an empty memo
+    program.environment.bind(x=1)
+    assert program.evaluate() == 25
+    assert calls.count(shared) == 1
+
+
+def test_program_without_repeats_is_kept():
+    program = parse("x * y + 1; 2.0 + 2", x=3, y=4)
+    assert Interner().intern(program) is program
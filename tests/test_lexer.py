@@ -0,0 +1,85 @@
+import io
+import random
+
+import pytest
+
+from Lexer import CHUNK_SIZE, Lexer, RegexLexer
+from Token import TokenBuffer
+
+PIECES = ["abc", "x1", "_y", "12", "3.5", "1.2.3", "==", "=", "+", "(", ")", ";", " ", "  ", "\n",
+          "if", "fn", "é", "abéc", "7.", "%", "{", "$"]
+
+
+def tokens(lexer, buffer=None):
+    if buffer is not None:
+        return [(token.type, token.literal, token.line_no, token.position) for token in lexer.tokenize(buffer)]
+    return [(token.type, token.literal, token.line_no, token.position) for token in lexer.tokenize()]
+
+
+def random_sources(seed, count):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 60)))
+
+
+@pytest.mark.parametrize("source", [
+    "",
+    "x = 1.5 * (y + 2)\nfn f(a) = if (a == 0) 1 else a % 3",
+    "1.2.3 $ abéc\n\n  7. ;",
+])
+def test_regex_lexer_matches_classic(source):
+    expected = tokens(Lexer(source))
+    assert tokens(RegexLexer(source)) == expected
+    assert tokens(RegexLexer(source), TokenBuffer()) == expected
+
+
+def test_regex_lexer_matches_classic_on_random_sources():
+    for source in random_sources(3, 300):
+        expected = tokens(Lexer(source))
+        assert tokens(RegexLexer(source)) == expected, source
+        assert tokens(RegexLexer(source), TokenBuffer()) == expected, source
+
+
+class SmallReads:
+    """File object whose read() returns at most `size` characters or bytes."""
+    def __init__(self, file, size):
+        self.file = file
+        self.size = size
+
+    def read(self, size=-1):
+        return self.file.read(self.size)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8])
+def test_chunk_boundaries_do_not_change_tokens(size):
+    for source in random_sources(10, 100):
+        expected = tokens(Lexer(source))
+        for lexer in (Lexer, RegexLexer):
+            assert tokens(lexer(SmallReads(io.StringIO(source), size))) == expected, source
+            assert tokens(lexer(SmallReads(io.BytesIO(source.encode()), size))) == expected, source
+        assert tokens(RegexLexer(SmallReads(io.StringIO(source), size)), TokenBuffer()) == expected, source
+
+
+class WindowSizes(io.StringIO):
+    """Records the size of the lexer's window each time it reads a chunk."""
+    lexer = None
+
+    def __init__(self, text):
+        super().__init__(text)
+        self.sizes = []
+
+    def read(self, size=-1):
+        if self.lexer is not None:
+            self.sizes.append(len(self.lexer.source))
+        return super().read(size)
+
+
+def test_line_longer_than_a_chunk():
+    source = "x = 1" + " + 12.5" * (3 * CHUNK_SIZE // 7) + "\ny = x"
+    expected = tokens(Lexer(source))
+    assert tokens(RegexLexer(io.BytesIO(source.encode()))) == expected
+    file = WindowSizes(source)
+    lexer = file.lexer = RegexLexer(file)
+    assert tokens(lexer, TokenBuffer()) == expected
+    # The window does not grow to hold the whole line
+    assert len(file.sizes) > 3 and max(file.sizes) < 2 * CHUNK_SIZE
@@ -0,0 +1,54 @@
+import math
+
+import pytest
+
+from AST import FloatLiteral, InfixExpression, IntegerLiteral
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+from Serialize import Encoder, decode, encode
+
+
+def leaves(node):
+    if isinstance(node, InfixExpression):
+        return leaves(node.left) + leaves(node.right)
+    return [node]
+
+
+def test_round_trip_keeps_constants_distinct():
+    values = [0.0, -0.0, float("nan"), 1, 1.0, 1 << 80]
+    tree = FloatLiteral(values[0])
+    for value in values[1:]:
+        literal = IntegerLiteral(value) if type(value) is int else FloatLiteral(value)
+        tree = InfixExpression(tree, "+", literal)
+    decoded = [leaf.value for leaf in leaves(decode(encode(tree)))]
+    assert [type(value) for value in decoded] == [type(value) for value in values]
+    assert [math.copysign(1.0, value) for value in decoded[:2]] == [1.0, -1.0]
+    assert math.isnan(decoded[2])
+    assert decoded[3:] == values[3:]
+
+
+def test_round_trip_evaluates_the_same():
+    source = "fn f(a, b) = if (a < 1) b else f(a - 1, b * 2); x = 3; y = x / 2; f(x, y) + 0.5"
+    program = Parser(Lexer(source), Environment()).parse_program()
+    decoded = decode(encode(program))
+    assert encode(decoded) == encode(program)
+    assert decoded.evaluate() == program.evaluate()
+
+
+def test_data_after_the_root_is_rejected():
+    data = encode(IntegerLiteral(1))
+    with pytest.raises(ValueError):
+        decode(data + encode(IntegerLiteral(2)))
+    # A second root within the counts given by the header
+    encoder = Encoder()
+    encoder.encode(IntegerLiteral(1))
+    with pytest.raises(ValueError):
+        decode(encoder.encode(IntegerLiteral(2)))
+
+
+def test_truncated_data_is_rejected():
+    data = encode(InfixExpression(IntegerLiteral(1), "+", IntegerLiteral(2)))
+    for length in range(len(data)):
+        with pytest.raises(ValueError):
+            decode(data[:length])
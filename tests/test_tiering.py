@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import Tiering
+from AST import current_budget
+from Budget import Budget
+from Environment import Environment
+from Lexer import Lexer
+from Parser import Parser
+
+OPERATORS = ['+', '-', '*', '/', '%', '^', '<', '>', '==']
+
+
+def expression(rng, depth, bounded):
+    # Bounded programs make no calls and no large powers, so they finish without a budget
+    if depth == 0 or rng.random() < 0.2:
+        choice = rng.random()
+        if choice < 0.3:
+            return rng.choice(["x", "y", "z", "n"])
+        if choice < 0.4:
+            return f"{rng.randint(0, 9)}.{rng.randint(0, 99)}"
+        if choice < 0.45 and not bounded:
+            return str(rng.randint(0, 10 ** 30))
+        return str(rng.randint(0, 20))
+    choice = rng.random()
+    if choice < 0.12:
+        return f"if ({expression(rng, depth - 1, bounded)}) {expression(rng, depth - 1, bounded)} else {expression(rng, depth - 1, bounded)}"
+    if choice < 0.2 and not bounded:
+        return f"g({expression(rng, depth - 1, bounded)}, {expression(rng, depth - 1, bounded)})"
+    if choice < 0.25:
+        exponent = str(rng.randint(0, 3)) if bounded else expression(rng, 1, bounded)
+        return f"({expression(rng, depth - 1, bounded)} ^ {exponent} % {expression(rng, depth - 1, bounded)})"
+    operator = rng.choice(OPERATORS)
+    if operator == '^' and bounded:
+        return f"({expression(rng, depth - 1, bounded)} ^ {rng.randint(0, 3)})"
+    return f"({expression(rng, depth - 1, bounded)} {operator} {expression(rng, depth - 1, bounded)})"
+
+
+def program_source(rng, bounded):
+    statements = ["fn g(a, b) = if (a < 1) b else g(a - 1, b + a)", f"x = {expression(rng, 3, bounded)}",
+                  expression(rng, 3, bounded), f"y = x * {expression(rng, 2, bounded)}",
+                  f"z = {expression(rng, 4, bounded)}", f"{expression(rng, 4, bounded)} + z"]
+    return "; ".join(statements)
+
+
+def outcome(run):
+    try:
+        return "value", repr(run())
+    except Exception as e:
+        return type(e).__name__, str(e)
+
+
+def run_both(source, limits):
+    environment = Environment()
+    environment.bind(n=3)
+    program = Parser(Lexer(source), environment).parse_program()
+    compiled = Tiering.promote(program)
+    assert compiled is not None
+    saved = list(environment.values)
+    results = []
+    for run in (program.evaluate, lambda: compiled(current_budget())):
+        environment.values[:] = saved
+        # Function memos are dropped, so both runs make the same calls
+        environment.version += 1
+        if limits is None:
+            results.append((outcome(run), repr(environment.values)))
+            continue
+        budget = Budget(**limits)
+        with budget:
+            results.append((outcome(run), repr(environment.values), budget.steps))
+    return results
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tiered_programs_agree_with_interpreter(seed):
+    rng = random.Random(seed)
+    for _ in range(150):
+        source = program_source(rng, bounded=True)
+        interpreted, tiered = run_both(source, None)
+        assert tiered == interpreted, source
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_budgeted_tiered_programs_agree_with_interpreter(seed):
+    rng = random.Random(seed)
+    for _ in range(150):
+        source = program_source(rng, bounded=False)
+        limits = rng.choice([{"max_steps": rng.randint(1, 80), "max_bits": 64},
+                             {"max_steps": rng.randint(1, 400), "max_bits": 1 << 12},
+                             {"max_steps": 100000, "max_bits": 1 << 16}])
+        interpreted, tiered = run_both(source, limits)
+        assert tiered == interpreted, source
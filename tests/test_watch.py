@@ -0,0 +1,67 @@
+import io
+import re
+
+from Watch import Watcher
+
+SCRIPT = """a = 1
+b = a + 1
+b * 3
+c = 10
+c * 2
+"""
+
+
+class Run:
+    def __init__(self, watcher, text):
+        output = watcher.output
+        start = output.tell()
+        self.succeeded = watcher.update(text)
+        *self.lines, summary = output.getvalue()[start:].splitlines()
+        self.evaluated, self.statements = map(int, re.match(r"-- evaluated (\d+) of (\d+) statements", summary).groups())
+
+
+def watcher():
+    return Watcher("script.hx", output=io.StringIO())
+
+
+def test_only_changed_statements_are_evaluated_again():
+    watch = watcher()
+    run = Run(watch, SCRIPT)
+    assert run.succeeded and (run.evaluated, run.statements) == (5, 5)
+    assert run.lines == ["[1] 1", "[2] 2", "[3] 6", "[4] 10", "[5] 20"]
+
+    run = Run(watch, SCRIPT.replace("c = 10", "c = 11"))
+    assert (run.evaluated, run.statements) == (2, 5)
+    assert run.lines == ["[4] 11", "[5] 22"]
+
+    run = Run(watch, SCRIPT.replace("c = 10", "c = 11") + "d = a + c\n")
+    assert (run.evaluated, run.statements) == (1, 6)
+    assert run.lines == ["[6] 12"]
+    assert Run(watch, SCRIPT.replace("c = 10", "c = 11") + "d = a + c\n").evaluated == 0
+
+
+def test_assigning_the_same_value_stops_there():
+    watch = watcher()
+    Run(watch, SCRIPT)
+    run = Run(watch, SCRIPT.replace("a = 1", "a = 2 - 1"))
+    assert run.evaluated == 1 and run.lines == ["[1] 1"]
+    run = Run(watch, SCRIPT.replace("a = 1", "a = 4"))
+    assert run.evaluated == 3 and run.lines == ["[1] 4", "[2] 5", "[3] 15"]
+    assert watch.environment.get("b") == 5
+
+
+def test_calls_see_the_variables_their_function_reads():
+    watch = watcher()
+    script = "k = 2\nfn f(x) = x * k\nf(3)\nf(1) + 1\n7\n"
+    assert Run(watch, script).evaluated == 5
+    run = Run(watch, script.replace("k = 2", "k = 3"))
+    assert run.lines == ["[1] 3", "[3] 9", "[4] 4"]
+
+
+def test_error_stops_the_run_until_it_is_fixed():
+    watch = watcher()
+    Run(watch, SCRIPT)
+    run = Run(watch, SCRIPT.replace("b = a + 1", "b = a / 0"))
+    assert not run.succeeded and run.evaluated == 1 and run.lines[0].startswith("[2] Error")
+    run = Run(watch, SCRIPT)
+    assert run.succeeded and run.lines == ["[2] 2", "[3] 6"]